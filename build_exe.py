@@ -6,6 +6,22 @@ import platform
 from pathlib import Path
 import time
 import uuid
+import argparse
+import statistics
+
+# 打包配置：gui为原有的带图形界面的单文件版本；headless为不含图形界面的命令行/服务版本，
+# 适合服务器部署；headless-onedir输出为目录，启动时不必先把整个程序解压到临时目录
+PROFILES = {
+    "gui": {"gui": True, "onefile": True, "suffix": ""},
+    "headless": {"gui": False, "onefile": True, "suffix": "-headless"},
+    "headless-onedir": {"gui": False, "onefile": False, "suffix": "-headless-onedir"},
+}
+
+# 无头版本不需要的模块：图形界面以及运行时用不到的标准库
+HEADLESS_EXCLUDES = [
+    "tkinter", "_tkinter", "tqdm.tk", "unittest", "pydoc", "doctest", "pdb",
+    "lib2to3", "xmlrpc", "sqlite3", "curses", "turtle", "idlelib",
+]
 
 class AppPackager:
     def __init__(self):
@@ -227,6 +243,93 @@ class AppPackager:
             print(f"DMG创建失败: {e}")
             return False
     
+    def build_headless(self, profile):
+        """打包不含图形界面的命令行/服务版本（主要用于Linux服务器），返回是否成功"""
+        config = PROFILES[profile]
+        name = self.app_name + config["suffix"]
+        print(f"开始打包无头版本: {name} ({'单文件' if config['onefile'] else '目录'})...")
+        cmd = [
+            "pyinstaller",
+            "--name", name,
+            "--onefile" if config["onefile"] else "--onedir",
+            "--console",
+            "--noconfirm",
+            "--distpath", self.dist_dir,
+            "--workpath", os.path.join(self.build_dir, profile),  # 各配置分开构建，便于对比
+            "--specpath", self.spec_dir,
+            "--hidden-import", "requests",
+        ]
+        for module in HEADLESS_EXCLUDES:
+            cmd += ["--exclude-module", module]
+        if self.os != "Windows":
+            cmd.append("--strip")  # 去掉共享库中的符号表，减小体积
+        cmd.append(self.main_script)
+        
+        try:
+            subprocess.run(cmd, check=True)
+            print(f"打包成功！可执行文件位于: {self.binary_path(profile)}")
+            return True
+        except subprocess.CalledProcessError as e:
+            print(f"打包失败: {e}")
+            return False
+    
+    def artifact_path(self, profile):
+        """返回指定配置的发布产物：单文件版本为可执行文件，onedir版本和macOS的.app为目录"""
+        config = PROFILES[profile]
+        name = self.app_name + config["suffix"]
+        if config["gui"] and self.os == "Darwin":
+            return os.path.join(self.dist_dir, f"{name}.app")
+        if config["onefile"]:
+            return os.path.join(self.dist_dir, name + (".exe" if self.os == "Windows" else ""))
+        return os.path.join(self.dist_dir, name)
+    
+    def binary_path(self, profile):
+        """返回指定配置打包出的可执行文件路径"""
+        name = self.app_name + PROFILES[profile]["suffix"]
+        artifact = self.artifact_path(profile)
+        if artifact.endswith(".app"):
+            return os.path.join(artifact, "Contents", "MacOS", name)
+        if not PROFILES[profile]["onefile"]:
+            return os.path.join(artifact, name + (".exe" if self.os == "Windows" else ""))
+        return artifact
+    
+    def artifact_size(self, profile):
+        """可执行文件（单文件）或整个输出目录（onedir、.app）的字节数"""
+        path = self.artifact_path(profile)
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        total = 0
+        for root, _, files in os.walk(path):
+            total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return total
+    
+    def benchmark(self, profiles, runs=10):
+        """比较各配置的体积和启动时间（运行 --help 到退出的时间，取中位数）
+
+        返回是否所有配置都已打包且每次运行都正常退出。
+        """
+        success = True
+        print(f"\n{'配置':<20}{'体积(MB)':>12}{'首次启动(s)':>14}{'启动中位数(s)':>16}")
+        for profile in profiles:
+            path = self.binary_path(profile)
+            if not os.path.exists(path):
+                print(f"{profile:<20}{'未打包':>12}")
+                success = False
+                continue
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                completed = subprocess.run([path, "--help"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                timings.append(time.perf_counter() - started)
+                if completed.returncode != 0:
+                    print(f"{profile:<20}{'启动失败':>12}  (退出码 {completed.returncode})")
+                    success = False
+                    break
+            else:
+                print(f"{profile:<20}{self.artifact_size(profile) / 1024 / 1024:>12.1f}"
+                      f"{timings[0]:>14.3f}{statistics.median(timings):>16.3f}")
+        return success
+    
     def copy_readme(self):
         """复制README.md到dist目录"""
         readme_path = os.path.join(self.script_dir, "README.md")
@@ -240,8 +343,8 @@ class AppPackager:
             except Exception as e:
                 print(f"复制README.md时出错: {e}")
     
-    def run(self):
-        """运行完整的打包流程"""
+    def run(self, profile=None):
+        """运行完整的打包流程，profile为None时Windows/macOS打包图形界面版本，Linux打包无头版本"""
         print(f"=== {self.app_name} 打包脚本 ===")
         print(f"当前操作系统: {self.os}")
         
@@ -249,6 +352,14 @@ class AppPackager:
         if not self.prepare_build_environment():
             return False
         
+        profile = profile or ("gui" if self.os in ("Windows", "Darwin") else "headless")
+        create_dmg = False
+        if not PROFILES[profile]["gui"]:
+            success = self.build_headless(profile)
+            if success:
+                self.copy_readme()
+            return success
+        
         # 根据操作系统执行不同的打包流程
         if self.os == "Windows":
             success = self.build_windows_exe()
@@ -266,8 +377,7 @@ class AppPackager:
                     if not dmg_success:
                         print("DMG创建失败，但应用程序已成功打包")
         else:
-            print(f"当前操作系统 {self.os} 暂不支持一键打包")
-            print("您可以尝试手动打包: pyinstaller --name {self.app_name} --onefile --windowed {self.main_script}")
+            print(f"当前操作系统 {self.os} 暂不支持打包图形界面版本，可使用 --profile headless 打包命令行版本")
             return False
         
         # 在Windows和非DMG的macOS上也复制README
@@ -277,11 +387,35 @@ class AppPackager:
         return success
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="打包MP4MoovFixer")
+    parser.add_argument("--profile", choices=list(PROFILES),
+                        help="打包配置，默认Windows/macOS为gui，其他系统为headless")
+    parser.add_argument("--benchmark", nargs="*", choices=list(PROFILES), metavar="PROFILE",
+                        help="打包后比较各配置的体积和启动时间，不指定配置时比较两种无头版本")
+    parser.add_argument("--runs", type=int, default=10, help="测量启动时间的运行次数，默认10")
+    args = parser.parse_args()
+    
     packager = AppPackager()
-    if packager.run():
+    if args.benchmark is not None:
+        profiles = args.benchmark or ["headless", "headless-onedir"]
+        if not packager.prepare_build_environment():
+            sys.exit(1)
+        built = True
+        for profile in profiles:
+            if PROFILES[profile]["gui"]:
+                built = packager.run(profile) and built
+            else:
+                built = packager.build_headless(profile) and built
+        # 某个配置打包失败时仍比较其余配置，但以非零状态退出，便于CI发现
+        sys.exit(0 if packager.benchmark(profiles, args.runs) and built else 1)
+    
+    success = packager.run(args.profile)
+    if success:
         print("\n打包完成！您可以在dist目录中找到生成的可执行文件。")
     else:
         print("\n打包失败，请查看错误信息并尝试解决问题。")
 
-    # 让窗口保持打开状态，直到用户按下任意键
-    input("按任意键退出...")
\ No newline at end of file
+    # 让窗口保持打开状态，直到用户按下任意键（在终端中双击运行时有用，服务器上的非交互构建不等待）
+    if sys.stdin.isatty():
+        input("按任意键退出...")
+    sys.exit(0 if success else 1)
\ No newline at end of file
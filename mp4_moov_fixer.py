@@ -2,27 +2,1721 @@ import os
 import sys
 import subprocess
 import shutil
-import requests
 import zipfile
 import time
-from tqdm import tqdm
 import argparse
 from pathlib import Path
-import tkinter as tk
-from tkinter import filedialog, ttk, scrolledtext, messagebox
 import threading
+import hashlib
+import re
+import json
+import socket
+import uuid
+import queue
+import itertools
+import http.client
+import http.server
+import socketserver
+import concurrent.futures
+import mmap
+import errno
+import struct
+import bisect
+import heapq
+import contextlib
+import stat
+from urllib.parse import urlparse
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 图形界面模块只在GUI模式下导入（见load_gui），命令行、服务模式和无头打包不依赖tkinter；
+# requests和tqdm也只在下载FFmpeg时导入，以缩短命令行的启动时间
+tk = filedialog = ttk = scrolledtext = messagebox = None
+
+
+def parse_shard(value):
+    """解析 "k/n" 格式的分片参数，k 从1开始编号"""
+    try:
+        k, n = (int(part) for part in value.split("/", 1))
+    except (ValueError, AttributeError):
+        raise argparse.ArgumentTypeError(f"分片参数格式应为 k/n，例如 1/4: {value}")
+    if n < 1 or not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(f"分片参数超出范围（要求 1 <= k <= n）: {value}")
+    return k, n
+
+
+def stable_path_hash(rel_path):
+    """计算与平台无关的稳定路径哈希，保证所有节点对同一文件得到相同的结果"""
+    normalized = rel_path.replace(os.sep, "/").replace("\\", "/")
+    return int(hashlib.sha1(normalized.encode("utf-8")).hexdigest(), 16)
+
+
+def parse_size(value):
+    """解析带单位的容量字符串，例如 "512M"、"10G"、"1.5TiB"，返回字节数"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"无法识别的容量: {value}")
+    exponent = " KMGT".index(match.group(2).upper() or " ")
+    return int(float(match.group(1)) * 1024 ** exponent)
+
+
+def scan_top_level_boxes(path):
+    """只读取各个顶层box的头部（8或16字节），返回 [(类型, 偏移, 大小), ...]
+
+    不读取box内容，即使是几十GB的文件也只需要少量随机读。遇到截断或无法解析的头部时停止。
+    """
+    boxes = []
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(8)
+            size = int.from_bytes(header[:4], "big")
+            box_type = header[4:8].decode("latin-1")
+            if size == 1:
+                largesize = f.read(8)
+                if len(largesize) < 8:
+                    break
+                size = int.from_bytes(largesize, "big")
+            elif size == 0:
+                size = file_size - offset  # 最后一个box延伸到文件末尾
+            if size < 8 or offset + size > file_size:
+                break
+            boxes.append((box_type, offset, size))
+            offset += size
+    return boxes
+
+
+def estimate_output_size(path):
+    """根据顶层box头部估算输出文件需要的字节数
+
+    faststart只移动moov的位置，输出大小与所有可识别box的总大小基本一致；
+    无法解析时退回到输入文件大小。
+    """
+    try:
+        boxes = scan_top_level_boxes(path)
+        if boxes:
+            return sum(size for _, _, size in boxes)
+    except OSError:
+        pass
+    return os.path.getsize(path)
+
+
+def free_disk_space(path):
+    """返回path所在卷上当前用户可用的字节数"""
+    if hasattr(os, "statvfs"):
+        st = os.statvfs(path)
+        return st.f_bavail * st.f_frsize
+    return shutil.disk_usage(path).free
+
+
+SCHEDULE_POLICIES = ("listdir", "largest", "smallest", "mtime")
+
+
+def order_files(names, stats, policy="listdir"):
+    """按调度策略排列待处理文件
+
+    listdir: 保持目录扫描顺序
+    largest: 大文件优先（LPT），并行时使整批完成时间最短
+    smallest: 小文件优先，最快得到第一批结果
+    mtime: 按修改时间从旧到新，先到的文件先处理
+    stats 为文件名到 os.stat_result 的映射，直接使用目录扫描时得到的信息。
+    """
+    if policy == "largest":
+        return sorted(names, key=lambda name: stats[name].st_size, reverse=True)
+    if policy == "smallest":
+        return sorted(names, key=lambda name: stats[name].st_size)
+    if policy == "mtime":
+        return sorted(names, key=lambda name: stats[name].st_mtime)
+    if policy != "listdir":
+        raise ValueError(f"未知的调度策略: {policy}")
+    return list(names)
+
+
+CLAIMED_ELSEWHERE = "已由其他节点完成或正在处理"
+NO_SPACE = "输出卷剩余空间不足"
+OUTSIDE_OUTPUT = "输出路径不在输出目录中"
+DEDUP_METHODS = {"reflink": "通过reflink共享", "hardlink": "硬链接", "copy": "复制", "existing": "保留"}
+
+
+def detect_layout(path):
+    """根据顶层box顺序判断文件布局
+
+    返回 "faststart"（moov在mdat之前）、"moov-at-end"（moov在mdat之后）、
+    "fragmented"（分片MP4）、"no-moov"（缺少moov）或 "unreadable"（无法解析）。
+    """
+    try:
+        types = [box_type for box_type, _, _ in scan_top_level_boxes(path)]
+    except OSError:
+        return "unreadable"
+    if not types:
+        return "unreadable"
+    if "moof" in types:
+        return "fragmented"
+    if "moov" not in types:
+        return "no-moov"
+    if "mdat" in types and types.index("mdat") < types.index("moov"):
+        return "moov-at-end"
+    return "faststart"
+
+
+class FixResult:
+    """单个文件的处理结果
+
+    action 为 "fixed"（已修复）、"copied"（无需修复，直接复制）、"duplicate"（内容与已处理的文件相同，
+    链接到已有输出，duplicate_of 为该输出）、"skipped"（由其他节点处理）或 "failed"；
+    durations 记录各阶段耗时（秒），例如 check、fix/copy、total；
+    sparse_bytes 为因源文件空洞而跳过、在输出中保留为空洞的字节数。
+    """
+
+    __slots__ = ("src", "dst", "layout", "action", "bytes_read", "bytes_written", "sparse_bytes", "durations", "error",
+                 "duplicate_of", "interleave", "bytes_saved")
+
+    def __init__(self, src, dst, layout=None, action="failed", error=None):
+        self.src = src
+        self.dst = dst
+        self.layout = layout
+        self.action = action
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.sparse_bytes = 0  # 源文件空洞中未读写的字节数
+        self.duplicate_of = None  # 内容重复时，作为来源的已处理输出文件
+        self.interleave = None  # 重新交错时的启动缓冲需求报告（交错前后的字节数和秒数）
+        self.bytes_saved = 0  # 紧凑布局减少的字节数
+        self.durations = {}
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.action != "failed"
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"FixResult({os.path.basename(self.src)!r}, action={self.action!r}, layout={self.layout!r}, error={self.error!r})"
+
+
+def device_readahead_bytes(path_or_fd, default=2 * 1024 * 1024):
+    """读取文件所在设备的预读大小（Linux下来自/sys），用于确定预读窗口"""
+    try:
+        st = os.stat(path_or_fd)
+        dev = f"{os.major(st.st_dev)}:{os.minor(st.st_dev)}"
+    except (OSError, AttributeError):
+        return default
+    # bdi对网络文件系统同样存在；块设备分区需要到父设备的queue目录查找
+    candidates = [
+        f"/sys/class/bdi/{dev}/read_ahead_kb",
+        f"/sys/dev/block/{dev}/queue/read_ahead_kb",
+        f"/sys/dev/block/{dev}/../queue/read_ahead_kb",
+    ]
+    for candidate in candidates:
+        try:
+            with open(candidate) as f:
+                kb = int(f.read().strip())
+            if kb > 0:
+                return kb * 1024
+        except (OSError, ValueError):
+            continue
+    return default
+
+
+def _fadvise(fd, offset, length, advice_name):
+    """调用posix_fadvise，平台不支持时忽略"""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
+    except OSError:
+        pass
+
+
+def drop_file_cache(path, written=False):
+    """把文件从页缓存中移除；written为True时先落盘，否则脏页无法被丢弃"""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDWR if written else os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        if written:
+            os.fdatasync(fd)
+        _fadvise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+    finally:
+        os.close(fd)
+
+
+def preallocate(fd, size):
+    """为输出文件预先分配空间，减少碎片并尽早暴露空间不足；不支持时忽略"""
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        pass  # 部分文件系统（如某些NFS）不支持，不影响后续写入
+
+
+def data_extents(fd, start, length):
+    """用SEEK_DATA/SEEK_HOLE找出[start, start+length)中真正有数据的区域，返回 [(偏移, 长度), ...]
+
+    不支持稀疏文件查询的平台或文件系统上整段视为数据。
+    """
+    end = start + length
+    if not hasattr(os, "SEEK_DATA"):
+        return [(start, length)] if length else []
+    extents = []
+    position = start
+    while position < end:
+        try:
+            data = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break  # 之后全是空洞
+            return [(start, length)]
+        if data >= end:
+            break
+        hole = os.lseek(fd, data, os.SEEK_HOLE)
+        extents.append((data, min(hole, end) - data))
+        position = hole
+    return extents
+
+
+def is_sparse(fd):
+    """文件实际占用的块少于其大小时说明包含空洞"""
+    st = os.fstat(fd)
+    return hasattr(st, "st_blocks") and st.st_blocks * 512 < st.st_size
+
+
+class BulkCopier:
+    """不污染页缓存、可并行的大文件拷贝
+
+    每个文件只读写一次，缓存它没有价值，反而会挤掉共享存储主机上其他服务的热数据。
+    缓冲模式下对源文件设置 POSIX_FADV_SEQUENTIAL，在读指针前方按设备预读大小发出
+    WILLNEED，并对已处理的区域发出 DONTNEED（目标文件先 fdatasync 再丢弃）。
+    direct_io 模式使用 O_DIRECT 和页对齐的缓冲区直接读写，完全绕过页缓存；
+    平台或文件系统不支持时自动退回缓冲模式。它只用于 copy_file 整文件复制：移动moov
+    和重建mdat时数据在源和目标中的偏移相差任意字节，无法满足O_DIRECT的对齐要求，
+    copy_extents 对这些区域总是使用缓冲模式（仍会丢弃已处理部分的缓存）。
+    threads 大于1时，把待复制的区域切成 extent_size 大小的段，由线程池用
+    pread/pwrite 并发复制，使单个大文件也能用满NVMe或网络文件系统的带宽。
+    源文件中的空洞（SEEK_HOLE）不会被读写，输出文件中对应位置保持为空洞，
+    跳过的字节数累计在 sparse_bytes 中。
+    """
+
+    ALIGNMENT = 4096
+
+    def __init__(self, direct_io=False, chunk_size=8 * 1024 * 1024, sync_interval=64 * 1024 * 1024,
+                 threads=1, extent_size=64 * 1024 * 1024):
+        self.direct_io = direct_io and hasattr(os, "O_DIRECT")
+        self.chunk_size = chunk_size
+        self.sync_interval = sync_interval  # 目标文件每写入这么多字节落盘一次并丢弃缓存
+        # 没有pread/pwrite的平台（Windows）上多线程共享文件指针不安全，只能单线程
+        self.threads = max(1, threads) if hasattr(os, "pread") else 1
+        self.extent_size = max(self.ALIGNMENT, extent_size // self.ALIGNMENT * self.ALIGNMENT)
+        self.sparse_bytes = 0  # 因源文件空洞而跳过的字节数
+
+    def copy_file(self, src, dst):
+        """复制整个文件（包括权限和时间戳），返回复制的字节数"""
+        size = os.path.getsize(src)
+        copied = None
+        if self.direct_io:
+            try:
+                copied = self._copy_file_fds(src, dst, size, os.O_DIRECT)
+            except OSError:
+                copied = None  # 文件系统不支持O_DIRECT（如tmpfs），退回缓冲模式
+        if copied is None:
+            copied = self._copy_file_fds(src, dst, size, 0)
+        shutil.copystat(src, dst)
+        return copied
+
+    def _copy_file_fds(self, src, dst, size, extra_flags):
+        binary = getattr(os, "O_BINARY", 0)
+        src_fd = os.open(src, os.O_RDONLY | binary | extra_flags)
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | binary | extra_flags, 0o644)
+            try:
+                # 预分配会把空洞变成实际占用的块，稀疏文件只设置大小
+                if not is_sparse(src_fd):
+                    preallocate(dst_fd, size)
+                copied = self.copy_extents(src_fd, dst_fd, [(0, 0, size)], direct=bool(extra_flags))
+                # 设置最终大小：保留末尾的空洞，并去掉O_DIRECT写入最后一块时补齐的部分
+                os.ftruncate(dst_fd, size)
+                return copied
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+
+    def copy_extents(self, src_fd, dst_fd, ranges, direct=False):
+        """复制若干 (源偏移, 目标偏移, 长度) 区域，返回复制的总字节数
+
+        direct为True时文件描述符须以O_DIRECT打开，且源偏移与目标偏移相同、按页对齐。
+        """
+        pieces = []
+        for src_offset, dst_offset, length in ranges:
+            extents = data_extents(src_fd, src_offset, length)
+            self.sparse_bytes += length - sum(n for _, n in extents)
+            for data_offset, data_length in extents:
+                shift = dst_offset - src_offset
+                for start in range(data_offset, data_offset + data_length, self.extent_size):
+                    n = min(self.extent_size, data_offset + data_length - start)
+                    pieces.append((start, start + shift, n))
+        copy = self._copy_range_direct if direct else self.copy_range
+        if self.threads == 1 or len(pieces) <= 1:
+            return sum(copy(src_fd, dst_fd, *piece) for piece in pieces)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as pool:
+            return sum(pool.map(lambda piece: copy(src_fd, dst_fd, *piece), pieces))
+
+    def copy_range(self, src_fd, dst_fd, src_offset, dst_offset, length):
+        """在两个文件描述符之间复制一段数据（缓冲模式），返回复制的字节数"""
+        readahead = device_readahead_bytes(src_fd)
+        window = max(self.chunk_size, readahead)
+        _fadvise(src_fd, src_offset, length, "POSIX_FADV_SEQUENTIAL")
+        _fadvise(src_fd, src_offset, window, "POSIX_FADV_WILLNEED")
+        done = 0
+        unsynced_from = dst_offset
+        while done < length:
+            n = min(self.chunk_size, length - done)
+            data = self._read_at(src_fd, n, src_offset + done)
+            if not data:
+                break
+            self._write_all(dst_fd, data, dst_offset + done)
+            # 读指针之后的区域提前预读，之前的区域从缓存中丢弃
+            _fadvise(src_fd, src_offset + done + window, n, "POSIX_FADV_WILLNEED")
+            _fadvise(src_fd, src_offset + done, len(data), "POSIX_FADV_DONTNEED")
+            done += len(data)
+            if dst_offset + done - unsynced_from >= self.sync_interval:
+                self._drop_written(dst_fd, unsynced_from, dst_offset + done - unsynced_from)
+                unsynced_from = dst_offset + done
+        self._drop_written(dst_fd, unsynced_from, dst_offset + done - unsynced_from)
+        return done
+
+    def _copy_range_direct(self, src_fd, dst_fd, offset, _dst_offset, length):
+        """O_DIRECT复制：缓冲区由mmap分配（天然页对齐），最后一块补齐到对齐长度后写入"""
+        chunk = max(self.ALIGNMENT, self.chunk_size // self.ALIGNMENT * self.ALIGNMENT)
+        buf = mmap.mmap(-1, chunk)
+        try:
+            done = 0
+            with memoryview(buf) as view:
+                while done < length:
+                    want = min(chunk, -(-(length - done) // self.ALIGNMENT) * self.ALIGNMENT)
+                    n = os.preadv(src_fd, [view[:want]], offset + done)
+                    if n <= 0:
+                        break
+                    n = min(n, length - done)
+                    aligned = -(-n // self.ALIGNMENT) * self.ALIGNMENT
+                    if aligned != n:
+                        view[n:aligned] = bytes(aligned - n)
+                    written = 0
+                    while written < aligned:
+                        written += os.pwritev(dst_fd, [view[written:aligned]], offset + done + written)
+                    done += n
+        finally:
+            buf.close()
+        return done
+
+    def _drop_written(self, fd, offset, length):
+        if length <= 0 or not hasattr(os, "posix_fadvise"):
+            return
+        os.fdatasync(fd)
+        _fadvise(fd, offset, length, "POSIX_FADV_DONTNEED")
+
+    @staticmethod
+    def _read_at(fd, n, offset):
+        if hasattr(os, "pread"):
+            return os.pread(fd, n, offset)
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, n)
+
+    @staticmethod
+    def _write_all(fd, data, offset):
+        view = memoryview(data)
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(fd, view, offset)
+            else:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+            view = view[written:]
+            offset += written
+
+
+class NativeUnsupported(Exception):
+    """文件结构不适合原生处理，需要交给FFmpeg"""
+
+
+class MP4Box:
+    """moov内部的box树节点：容器box保存子节点，其余box保存原始内容"""
+
+    # 只展开通向采样表的容器，其余box原样保留
+    CONTAINERS = {"moov", "trak", "mdia", "minf", "stbl"}
+
+    __slots__ = ("type", "payload", "children")
+
+    def __init__(self, box_type, payload=b"", children=None):
+        self.type = box_type
+        self.payload = payload
+        self.children = children
+
+    @classmethod
+    def parse(cls, data, offset=0, end=None):
+        """解析data[offset:end]中的一串box"""
+        end = len(data) if end is None else end
+        boxes = []
+        while offset + 8 <= end:
+            size, box_type = struct.unpack_from(">I4s", data, offset)
+            box_type = box_type.decode("latin-1")
+            header = 8
+            if size == 1:
+                if offset + 16 > end:
+                    raise NativeUnsupported("box头部被截断")
+                size = struct.unpack_from(">Q", data, offset + 8)[0]
+                header = 16
+            elif size == 0:
+                size = end - offset
+            if size < header or offset + size > end:
+                raise NativeUnsupported(f"box大小无效: {box_type}")
+            if box_type in cls.CONTAINERS:
+                boxes.append(cls(box_type, children=cls.parse(data, offset + header, offset + size)))
+            else:
+                boxes.append(cls(box_type, payload=bytes(data[offset + header:offset + size])))
+            offset += size
+        return boxes
+
+    def serialize(self):
+        body = b"".join(child.serialize() for child in self.children) if self.children is not None else self.payload
+        if len(body) + 8 > 0xFFFFFFFF:
+            return struct.pack(">I4sQ", 1, self.type.encode("latin-1"), len(body) + 16) + body
+        return struct.pack(">I4s", len(body) + 8, self.type.encode("latin-1")) + body
+
+    def find_all(self, box_type):
+        """深度优先查找所有指定类型的子孙box"""
+        for child in self.children or ():
+            if child.type == box_type:
+                yield child
+            yield from child.find_all(box_type)
+
+
+def free_box_header(size):
+    """大小为size的free box的头部，box内容不必写入（预分配的区域读出为0）"""
+    if size > 0xFFFFFFFF:
+        return struct.pack(">I4sQ", 1, b"free", size)
+    return struct.pack(">I4s", size, b"free")
+
+
+def read_chunk_offsets(box):
+    """读取stco/co64中的块偏移列表"""
+    try:
+        count = struct.unpack_from(">I", box.payload, 4)[0]
+        fmt = ">%dI" if box.type == "stco" else ">%dQ"
+        return list(struct.unpack_from(fmt % count, box.payload, 8))
+    except struct.error as e:
+        raise NativeUnsupported(f"{box.type}被截断") from e
+
+
+def write_chunk_offsets(box, offsets):
+    """写回块偏移，任何偏移超出32位时把stco升级为co64"""
+    if box.type == "stco" and offsets and max(offsets) > 0xFFFFFFFF:
+        box.type = "co64"
+    fmt = ">%dI" if box.type == "stco" else ">%dQ"
+    box.payload = box.payload[:4] + struct.pack(">I", len(offsets)) + struct.pack(fmt % len(offsets), *offsets)
+
+
+class NativeRelocator:
+    """不经过FFmpeg，直接在字节层面把moov移动到mdat之前
+
+    只读取moov本身，修改其中stco/co64的块偏移后写出 [mdat之前的box][moov][其余box]，
+    其余box（主要是mdat）由BulkCopier按区域复制。输出与输入大小相同，不涉及重新封装。
+    padding 大于0时在moov之后预留一个该大小的free box，之后增大moov的元数据修改可以
+    在原位完成（见 update_moov）。
+    遇到分片MP4、多个moov、含绝对偏移的saio等情况时抛出NativeUnsupported。
+    """
+
+    def __init__(self, src, copier=None, padding=0, drop_trailing=False):
+        self.src = src
+        self.copier = copier or BulkCopier()
+        self.padding = max(padding, 8) if padding > 0 else 0  # free box至少要有8字节的头部
+        self.boxes = scan_top_level_boxes(src)
+        types = [box_type for box_type, _, _ in self.boxes]
+        if "moof" in types:
+            raise NativeUnsupported("分片MP4")
+        if types.count("moov") != 1 or "mdat" not in types:
+            raise NativeUnsupported("缺少moov/mdat或存在多个moov")
+        trailing = os.path.getsize(src) - sum(size for _, _, size in self.boxes)
+        if trailing and not drop_trailing:
+            raise NativeUnsupported(f"文件末尾有 {trailing} 字节无法识别的数据")
+        _, moov_offset, moov_size = self.boxes[types.index("moov")]
+        with open(src, "rb") as f:
+            f.seek(moov_offset)
+            moov_data = f.read(moov_size)
+        self.set_moov(MP4Box.parse(moov_data)[0])
+
+    def set_moov(self, moov):
+        """设置要写出的moov（例如调用方已修改过的moov），块偏移仍以原文件中的位置为准"""
+        if any(True for _ in moov.find_all("saio")):
+            raise NativeUnsupported("采样辅助信息使用绝对偏移(saio)")
+        self.moov = moov
+        self.offset_boxes = list(moov.find_all("stco")) + list(moov.find_all("co64"))
+        self.original_offsets = [read_chunk_offsets(box) for box in self.offset_boxes]
+
+    def plan(self):
+        """计算输出布局，返回 (头部box列表, 其余box列表, moov字节)
+
+        头部为第一个mdat之前的box（不含moov），其余为之后的全部box（不含moov）。
+        """
+        first_mdat = next(i for i, (t, _, _) in enumerate(self.boxes) if t == "mdat")
+        head = [box for box in self.boxes[:first_mdat] if box[0] != "moov"]
+        tail = [box for box in self.boxes[first_mdat:] if box[0] != "moov"]
+        moov_start = sum(size for _, _, size in head)
+        # stco升级为co64会增大moov，从而再次改变偏移，循环直到moov大小稳定
+        moov_size = None
+        moov_bytes = self.moov.serialize()
+        while moov_size != len(moov_bytes):
+            moov_size = len(moov_bytes)
+            mapping = self._offset_mapping(head, tail, moov_start + moov_size + self.padding)
+            for box, offsets in zip(self.offset_boxes, self.original_offsets):
+                write_chunk_offsets(box, [mapping(offset) for offset in offsets])
+            moov_bytes = self.moov.serialize()
+        return head, tail, moov_bytes
+
+    def _offset_mapping(self, head, tail, tail_start):
+        """返回把原文件偏移映射到输出文件偏移的函数"""
+        shifts = []
+        position = 0
+        for _, offset, size in head:
+            shifts.append((offset, size, position - offset))
+            position += size
+        position = tail_start
+        for _, offset, size in tail:
+            shifts.append((offset, size, position - offset))
+            position += size
+        shifts.sort()
+        starts = [offset for offset, _, _ in shifts]
+
+        def mapping(old):
+            i = bisect.bisect_right(starts, old) - 1
+            if i < 0 or old >= shifts[i][0] + shifts[i][1]:
+                raise NativeUnsupported(f"块偏移 {old} 不在任何box内")
+            return old + shifts[i][2]
+        return mapping
+
+    def write(self, dst):
+        """写出faststart文件，返回写入的字节数"""
+        head, tail, moov_bytes = self.plan()
+        total = (sum(size for _, _, size in head) + len(moov_bytes) + self.padding
+                 + sum(size for _, _, size in tail))
+        binary = getattr(os, "O_BINARY", 0)
+        src_fd = os.open(self.src, os.O_RDONLY | binary)
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | binary, 0o644)
+            try:
+                if not is_sparse(src_fd):
+                    preallocate(dst_fd, total)
+                ranges = []
+                position = 0
+                for _, offset, size in head:
+                    ranges.append((offset, position, size))
+                    position += size
+                BulkCopier._write_all(dst_fd, moov_bytes, position)
+                position += len(moov_bytes)
+                if self.padding:
+                    BulkCopier._write_all(dst_fd, free_box_header(self.padding), position)
+                    position += self.padding
+                for _, offset, size in tail:
+                    ranges.append((offset, position, size))
+                    position += size
+                self.copier.copy_extents(src_fd, dst_fd, ranges)
+                os.ftruncate(dst_fd, total)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        return total
+
+
+class TrackSamples:
+    """从trak的采样表中展开每个样本的位置、大小、解码时间和样本描述索引
+
+    采样表被截断或互相矛盾时抛出NativeUnsupported，由调用方改用FFmpeg或按普通流程处理。
+    """
+
+    def __init__(self, trak):
+        self.trak = trak
+        try:
+            self._load(trak)
+        except (struct.error, IndexError, KeyError, ValueError) as e:
+            raise NativeUnsupported(f"采样表损坏（{e}）") from e
+
+    def _load(self, trak):
+        mdhd = next(trak.find_all("mdhd"), None)
+        stbl = next(trak.find_all("stbl"), None)
+        if mdhd is None or stbl is None:
+            raise NativeUnsupported("trak缺少mdhd或stbl")
+        self.timescale = struct.unpack_from(">I", mdhd.payload, 20 if mdhd.payload[0] == 1 else 12)[0] or 1
+        tables = {child.type: child for child in stbl.children}
+        if "stz2" in tables:
+            raise NativeUnsupported("不支持stz2紧凑样本大小表")
+        self.offset_box = tables.get("stco") or tables.get("co64")
+        self.stsc = tables.get("stsc")
+        if self.offset_box is None or self.stsc is None or "stsz" not in tables or "stts" not in tables:
+            raise NativeUnsupported("采样表不完整")
+
+        stsz = tables["stsz"].payload
+        uniform_size, count = struct.unpack_from(">II", stsz, 4)
+        self.sizes = [uniform_size] * count if uniform_size else list(struct.unpack_from(">%dI" % count, stsz, 12))
+
+        stts = tables["stts"].payload
+        self.dts = []
+        time_value = 0
+        for i in range(struct.unpack_from(">I", stts, 4)[0]):
+            sample_count, delta = struct.unpack_from(">II", stts, 8 + i * 8)
+            for _ in range(sample_count):
+                self.dts.append(time_value)
+                time_value += delta
+        self.duration = time_value / self.timescale
+
+        # 按stsc把块展开为样本：offsets为每个样本在文件中的位置
+        chunk_offsets = read_chunk_offsets(self.offset_box)
+        stsc = self.stsc.payload
+        entries = [struct.unpack_from(">III", stsc, 8 + i * 12) for i in range(struct.unpack_from(">I", stsc, 4)[0])]
+        self.offsets = []
+        self.description = []
+        self.chunks = []  # 原文件中的分块 (块偏移, 首个样本序号, 样本数)
+        sample = 0
+        for i, (first_chunk, per_chunk, description) in enumerate(entries):
+            last_chunk = entries[i + 1][0] - 1 if i + 1 < len(entries) else len(chunk_offsets)
+            for chunk in range(first_chunk - 1, last_chunk):
+                position = chunk_offsets[chunk]
+                self.chunks.append((position, sample, per_chunk))
+                for _ in range(per_chunk):
+                    if sample >= len(self.sizes):
+                        raise NativeUnsupported("stsc与stsz的样本数不一致")
+                    self.offsets.append(position)
+                    self.description.append(description)
+                    position += self.sizes[sample]
+                    sample += 1
+        if sample != len(self.sizes) or len(self.dts) != len(self.sizes):
+            raise NativeUnsupported("采样表之间的样本数不一致")
+
+    def samples(self):
+        """逐个返回 (解码时间秒, 文件偏移, 大小)"""
+        for dts, offset, size in zip(self.dts, self.offsets, self.sizes):
+            yield dts / self.timescale, offset, size
+
+    def write_chunks(self, chunks, chunk_offsets):
+        """用新的分块（每块为 (首个样本序号, 样本数)）改写stsc和块偏移"""
+        entries = []
+        for index, (first, count) in enumerate(chunks):
+            description = self.description[first]
+            if not entries or entries[-1][1:] != (count, description):
+                entries.append((index + 1, count, description))
+        self.stsc.payload = (self.stsc.payload[:4] + struct.pack(">I", len(entries))
+                             + b"".join(struct.pack(">III", *entry) for entry in entries))
+        write_chunk_offsets(self.offset_box, chunk_offsets)
+
+
+def startup_buffer(samples, duration):
+    """按文件顺序下载、下载速度等于平均码率时，播放前需要预先缓冲的字节数
+
+    samples 为 (解码时间秒, 文件偏移, 大小)。播放到时刻t需要已下载到所有 t 之前样本的末尾，
+    所需缓冲即该位置与按平均码率到t时已下载量之差的最大值。
+    """
+    samples = sorted(samples)
+    if not samples or duration <= 0:
+        return 0
+    base = min(offset for _, offset, _ in samples)
+    rate = sum(size for _, _, size in samples) / duration
+    reach = need = 0
+    for seconds, offset, size in samples:
+        reach = max(reach, offset + size - base)
+        need = max(need, reach - seconds * rate)
+    return int(need)
+
+
+class MdatRewriter(NativeRelocator):
+    """按采样表重建mdat的同时移动moov，只复制被样本引用的数据
+
+    写出 [mdat之前的box][moov][预留free][新mdat][其余box]，只改写stsc和stco/co64，
+    样本内容、顺序与时间戳不变；原mdat中不属于任何样本的数据不会被复制。
+    默认保持原有的分块和顺序，子类可通过 _chunks 重新分块。
+    compact 为True时同时丢弃free/skip/wide等填充box和文件末尾无法识别的数据。
+    """
+
+    PADDING_BOXES = {"free", "skip", "wide"}
+
+    def __init__(self, src, copier=None, padding=0, compact=False):
+        super().__init__(src, copier, padding, drop_trailing=compact)
+        self.compact = compact
+        self.tracks = [TrackSamples(trak) for trak in self.moov.find_all("trak")]
+        self.duration = max((track.duration for track in self.tracks), default=0)
+        self._plan = None
+
+    def buffer_before(self):
+        """原文件的启动缓冲需求（字节）"""
+        return startup_buffer([s for track in self.tracks for s in track.samples()], self.duration)
+
+    def buffer_after(self):
+        """重建后的启动缓冲需求（字节）"""
+        return self.plan()[5]
+
+    def output_size(self):
+        """重建后的文件大小"""
+        head, tail, moov_bytes, mdat_header, ranges, _ = self.plan()
+        return (sum(size for _, _, size in head) + len(moov_bytes) + self.padding + len(mdat_header)
+                + sum(length for _, _, length in ranges) + sum(size for _, _, size in tail))
+
+    def _chunks(self):
+        """返回输出中的块顺序 [(轨道序号, 首个样本序号, 样本数)]，默认按原文件中的位置排列
+
+        各轨道的块必须保持采样表中的顺序，因此按位置归并各轨道的块列表而不是整体排序：
+        某个轨道的块偏移不递增时，该轨道的块仍按样本顺序输出。
+        """
+        per_track = [[(offset, track_index, first, count) for offset, first, count in track.chunks]
+                     for track_index, track in enumerate(self.tracks)]
+        return [(track_index, first, count) for _, track_index, first, count in heapq.merge(*per_track)]
+
+    def _kept(self, boxes):
+        dropped = {"moov", "mdat"} | (self.PADDING_BOXES if self.compact else set())
+        return [box for box in boxes if box[0] not in dropped]
+
+    def plan(self):
+        """计算输出布局，返回 (头部box列表, 其余box列表, moov字节, mdat头部, 复制区域, 启动缓冲需求)
+
+        复制区域为 (原偏移, 相对新mdat数据起点的偏移, 长度)。各块的新偏移与moov大小一起一次算出。
+        """
+        if self._plan:
+            return self._plan
+        first_mdat = next(i for i, (t, _, _) in enumerate(self.boxes) if t == "mdat")
+        head = self._kept(self.boxes[:first_mdat])
+        tail = self._kept(self.boxes[first_mdat:])
+        chunks = self._chunks()
+
+        ranges = []
+        relative = {}  # (轨道序号, 块在该轨道中的序号) -> 块相对mdat数据起点的偏移
+        per_track = [[] for _ in self.tracks]
+        position = 0
+        for track_index, first, count in chunks:
+            track = self.tracks[track_index]
+            relative[(track_index, len(per_track[track_index]))] = position
+            per_track[track_index].append((first, count))
+            for sample in range(first, first + count):
+                offset, size = track.offsets[sample], track.sizes[sample]
+                if ranges and ranges[-1][0] + ranges[-1][2] == offset and ranges[-1][1] + ranges[-1][2] == position:
+                    ranges[-1] = (ranges[-1][0], ranges[-1][1], ranges[-1][2] + size)
+                elif size:
+                    ranges.append((offset, position, size))
+                position += size
+        data_size = position
+        mdat_header = (struct.pack(">I4s", data_size + 8, b"mdat") if data_size + 8 <= 0xFFFFFFFF
+                       else struct.pack(">I4sQ", 1, b"mdat", data_size + 16))
+
+        # 与NativeRelocator相同，循环直到co64升级后的moov大小稳定
+        head_size = sum(size for _, _, size in head)
+        moov_size = None
+        moov_bytes = self.moov.serialize()
+        while moov_size != len(moov_bytes):
+            moov_size = len(moov_bytes)
+            data_start = head_size + moov_size + self.padding + len(mdat_header)
+            for track_index, track in enumerate(self.tracks):
+                offsets = [data_start + relative[(track_index, i)] for i in range(len(per_track[track_index]))]
+                track.write_chunks(per_track[track_index], offsets)
+            moov_bytes = self.moov.serialize()
+
+        data_start = head_size + len(moov_bytes) + self.padding + len(mdat_header)
+        after = startup_buffer([(seconds, data_start + relative_offset, size)
+                                for seconds, relative_offset, size in self._new_positions(chunks)], self.duration)
+        self._plan = head, tail, moov_bytes, mdat_header, ranges, after
+        return self._plan
+
+    def _new_positions(self, chunks):
+        position = 0
+        for track_index, first, count in chunks:
+            track = self.tracks[track_index]
+            for sample in range(first, first + count):
+                yield track.dts[sample] / track.timescale, position, track.sizes[sample]
+                position += track.sizes[sample]
+
+    def write(self, dst):
+        """写出重建后的faststart文件，返回写入的字节数"""
+        head, tail, moov_bytes, mdat_header, sample_ranges, _ = self.plan()
+        data_size = sum(length for _, _, length in sample_ranges)
+        binary = getattr(os, "O_BINARY", 0)
+        src_fd = os.open(self.src, os.O_RDONLY | binary)
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | binary, 0o644)
+            try:
+                ranges = []
+                position = 0
+                for _, offset, size in head:
+                    ranges.append((offset, position, size))
+                    position += size
+                BulkCopier._write_all(dst_fd, moov_bytes + (free_box_header(self.padding) if self.padding else b""),
+                                      position)
+                position += len(moov_bytes) + self.padding
+                BulkCopier._write_all(dst_fd, mdat_header, position)
+                position += len(mdat_header)
+                ranges.extend((offset, position + relative, length) for offset, relative, length in sample_ranges)
+                position += data_size
+                for _, offset, size in tail:
+                    ranges.append((offset, position, size))
+                    position += size
+                if not is_sparse(src_fd):
+                    preallocate(dst_fd, position)
+                self.copier.copy_extents(src_fd, dst_fd, ranges)
+                os.ftruncate(dst_fd, position)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        return position
+
+    def report(self):
+        """启动缓冲需求报告：before/after 为重建前后的缓冲字节数，*_seconds 为按平均码率折算的秒数"""
+        before, after = self.buffer_before(), self.buffer_after()
+        data_size = sum(length for _, _, length in self.plan()[4])
+        rate = data_size / self.duration if self.duration else 0
+        return {"before": before, "after": after,
+                "before_seconds": round(before / rate, 2) if rate else 0,
+                "after_seconds": round(after / rate, 2) if rate else 0}
+
+
+class SampleInterleaver(MdatRewriter):
+    """在移动moov的同时按固定时长重新交错各轨道的样本，不解码、不改变样本内容
+
+    每个轨道的样本按 interval 秒划分成块，各轨道同一时段的块依次排列。
+    """
+
+    def __init__(self, src, copier=None, interval=0.5, padding=0, compact=False):
+        super().__init__(src, copier, padding, compact)
+        self.interval = interval
+
+    def _chunks(self):
+        """按播放时段交错排列：同一时段内依次为各轨道的块"""
+        chunks = []
+        for track_index, track in enumerate(self.tracks):
+            current = None
+            for sample, dts in enumerate(track.dts):
+                key = (int(dts / track.timescale / self.interval), track.description[sample])
+                if current and current[0] == key:
+                    current[2] += 1
+                else:
+                    current = [key, sample, 1]
+                    chunks.append((key[0], track_index, current))
+        chunks.sort(key=lambda chunk: (chunk[0], chunk[1], chunk[2][1]))
+        return [(track_index, first, count) for _, track_index, (_, first, count) in chunks]
+
+    def report(self):
+        report = super().report()
+        report["interval"] = self.interval
+        return report
+
+
+def set_moov_child(moov, box_type, payload):
+    """替换moov下指定类型的子box（如udta、meta），不存在时追加；payload为None时删除"""
+    children = [child for child in moov.children if child.type != box_type]
+    if payload is not None:
+        children.append(MP4Box(box_type, payload=payload))
+    moov.children = children
+
+
+def update_moov(path, edit, padding=64 * 1024, copier=None, dedup_index=None):
+    """修改文件中moov的元数据，能在原位完成时只改写moov及其后free box的字节
+
+    edit(moov) 就地修改传入的MP4Box树（例如用set_moov_child替换udta），不能改动块偏移，只调用一次。
+    新moov能放进原moov加上紧随其后的free/skip box的空间时原位写入，剩余空间重新标记为free；
+    moov是文件最后一个box时直接写入。否则重写整个文件，并在moov后重新预留padding字节。
+    文件有多个硬链接（例如--dedup-hardlink产生的重复输出）时总是重写，修改不会影响其他路径。
+    dedup_index（路径或DedupIndex）中记录了该文件时，更新其中的文件大小，使之后的去重查询仍然有效。
+    返回 "in-place" 或 "rewrite"。
+    """
+    boxes = scan_top_level_boxes(path)
+    types = [box_type for box_type, _, _ in boxes]
+    if types.count("moov") != 1:
+        raise NativeUnsupported("缺少moov或存在多个moov")
+    index = types.index("moov")
+    _, moov_offset, moov_size = boxes[index]
+    with open(path, "rb") as f:
+        f.seek(moov_offset)
+        moov = MP4Box.parse(f.read(moov_size))[0]
+    edit(moov)
+    moov_bytes = moov.serialize()
+
+    is_last = index == len(boxes) - 1
+    available = moov_size
+    padding_boxes = []
+    for box in boxes[index + 1:]:
+        if box[0] not in ("free", "skip"):
+            break
+        padding_boxes.append(box)
+        available += box[2]
+    spare = available - len(moov_bytes)
+    shared = os.stat(path).st_nlink > 1
+    if not shared and (is_last or spare == 0 or spare >= 8):
+        with open(path, "r+b") as f:
+            f.seek(moov_offset)
+            f.write(moov_bytes)
+            if is_last:
+                f.truncate()
+            elif spare:
+                f.write(free_box_header(spare))
+            f.flush()
+            os.fsync(f.fileno())
+        how = "in-place"
+    else:
+        # 预留空间不足或文件被共享：写出新文件后替换，块偏移由NativeRelocator按新的moov大小重新计算
+        relocator = NativeRelocator(path, copier, padding)
+        relocator.boxes = [box for box in relocator.boxes if box not in padding_boxes]  # 旧的预留空间不再保留
+        relocator.set_moov(moov)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            relocator.write(tmp_path)
+            shutil.copystat(path, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        how = "rewrite"
+    if dedup_index is not None:
+        if isinstance(dedup_index, (str, os.PathLike)):
+            dedup_index = DedupIndex(dedup_index)
+        dedup_index.update_output(path)
+    return how
+
+
+class SpaceBudget:
+    """按输出卷剩余空间准入文件
+
+    每个正在写入的文件按"预估大小 - 已写入大小"预留空间，只有当前剩余空间扣除
+    这些预留和保留空间后仍能容纳新文件时才允许开始处理。
+    """
+
+    def __init__(self, output_dir, reserve=0):
+        self.output_dir = output_dir
+        self.reserve = reserve
+        self.inflight = {}  # 输出路径 -> 预估大小
+        self.cond = threading.Condition()
+
+    def _pending_bytes(self):
+        pending = 0
+        for output_path, estimate in self.inflight.items():
+            try:
+                written = os.path.getsize(output_path)
+            except OSError:
+                written = 0
+            pending += max(0, estimate - written)
+        return pending
+
+    def available(self):
+        """扣除保留空间和在途预留后可以分配的字节数"""
+        with self.cond:
+            return free_disk_space(self.output_dir) - self.reserve - self._pending_bytes()
+
+    def admit(self, output_path, estimate, stop_check=None):
+        """等待直到输出能放下；没有在途文件仍放不下时返回False"""
+        with self.cond:
+            while True:
+                if free_disk_space(self.output_dir) - self.reserve - self._pending_bytes() >= estimate:
+                    self.inflight[output_path] = estimate
+                    return True
+                if not self.inflight or (stop_check and stop_check()):
+                    return False
+                self.cond.wait(timeout=1.0)
+
+    def release(self, output_path):
+        with self.cond:
+            self.inflight.pop(output_path, None)
+            self.cond.notify_all()
+
+
+# FFmpeg下载地址及对应的SHA-256校验文件地址（没有校验文件时为None）
+# 每个工作目录下已找到（或已下载）的FFmpeg路径，避免每次创建MP4MoovFixer都重新遍历目录；
+# 锁保证多个工作线程同时需要FFmpeg时只下载一次
+_ffmpeg_paths = {}
+_ffmpeg_lock = threading.Lock()
+
+FFMPEG_DOWNLOADS = {
+    "win32": ("https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip",
+              "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip.sha256"),
+    "darwin": ("https://evermeet.cx/ffmpeg/getrelease/darwin64/static/ffmpeg", None),
+}
+
+
+def default_cache_dir():
+    """下载缓存目录，可通过环境变量 MP4_MOOV_FIXER_CACHE 指定为多用户共享的目录"""
+    if os.environ.get("MP4_MOOV_FIXER_CACHE"):
+        return os.environ["MP4_MOOV_FIXER_CACHE"]
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "mp4_moov_fixer", "cache")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/mp4_moov_fixer")
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "mp4_moov_fixer")
+
+
+def sha256_of_file(path, chunk_size=4 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProgressThrottle:
+    """合并高频的进度更新，最多每 interval 秒回调一次（完成时总会回调）"""
+
+    def __init__(self, callback, total, interval=0.25):
+        self.callback = callback
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.reported = 0
+        self.last_time = 0.0
+        self.lock = threading.Lock()
+
+    def update(self, nbytes, force=False):
+        with self.lock:
+            self.done += nbytes
+            now = time.time()
+            if not force and now - self.last_time < self.interval and self.done < self.total:
+                return
+            delta = self.done - self.reported
+            self.reported = self.done
+            self.last_time = now
+        if self.callback:
+            self.callback(self.done, self.total, delta)
+
+
+class SegmentedDownloader:
+    """分段并行、可断点续传的HTTP下载器
+
+    服务器支持Range请求时把文件分成若干段，由多个连接并行下载，每段写入独立的
+    "<dest>.part<N>" 文件；失败重试或下次运行时从各段已有的长度继续。全部完成后
+    拼接为目标文件，并在拼接时计算SHA-256与期望值比对。单次读取的块大小根据实测
+    速度在64KB到4MB之间自动调整。
+    """
+
+    MIN_CHUNK = 64 * 1024
+    MAX_CHUNK = 4 * 1024 * 1024
+    MIN_SEGMENT = 4 * 1024 * 1024
+
+    def __init__(self, url, dest, connections=4, expected_sha256=None, progress=None, stop_check=None,
+                 retries=3, timeout=30):
+        self.url = url
+        self.dest = dest
+        self.connections = max(1, connections)
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        self.progress = progress  # progress(已下载字节, 总字节, 本次增量)
+        self.stop_check = stop_check
+        self.retries = retries
+        self.timeout = timeout
+
+    def _probe(self):
+        """返回 (总大小, 是否支持Range)"""
+        import requests
+        try:
+            r = requests.head(self.url, allow_redirects=True, timeout=self.timeout)
+            r.raise_for_status()
+            total = int(r.headers.get("content-length", 0))
+            ranges = r.headers.get("accept-ranges", "").lower() == "bytes"
+            self.url = r.url  # 使用重定向后的地址，避免每个分段重复跳转
+            return total, ranges and total > 0
+        except (requests.RequestException, ValueError):
+            return 0, False
+
+    def _part_path(self, index):
+        return f"{self.dest}.part{index}"
+
+    def _segments(self, total):
+        count = max(1, min(self.connections, total // self.MIN_SEGMENT))
+        size = -(-total // count)
+        return [(i, i * size, min(total, (i + 1) * size) - 1) for i in range(count)]
+
+    def _fetch_segment(self, index, start, end, throttle):
+        """下载一个分段，end为None表示不使用Range下载整个文件"""
+        import requests
+        import urllib3
+        part_path = self._part_path(index)
+        for attempt in range(self.retries + 1):
+            have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if end is not None and start + have > end:
+                return
+            headers = {}
+            if end is not None:
+                headers["Range"] = f"bytes={start + have}-{end}"
+            elif have:
+                headers["Range"] = f"bytes={have}-"
+            try:
+                with requests.get(self.url, headers=headers, stream=True, timeout=self.timeout) as r:
+                    r.raise_for_status()
+                    if headers and r.status_code != 206:
+                        # 服务器忽略了Range，只能从头下载
+                        if end is not None:
+                            raise IOError("服务器不支持分段下载")
+                        have = 0
+                    mode = "ab" if have and r.status_code == 206 else "wb"
+                    self._copy_stream(r, part_path, mode, throttle)
+                return
+            except (requests.RequestException, urllib3.exceptions.HTTPError, IOError) as e:
+                # 连接中途断开时raw.read抛出urllib3的异常，同样重试并从已下载的位置继续
+                if self.stop_check and self.stop_check():
+                    raise
+                if attempt == self.retries:
+                    raise IOError(f"分段 {index} 下载失败: {e}")
+                time.sleep(min(2 ** attempt, 10))
+
+    def _copy_stream(self, response, part_path, mode, throttle):
+        chunk = self.MIN_CHUNK
+        with open(part_path, mode) as f:
+            while True:
+                if self.stop_check and self.stop_check():
+                    raise IOError("下载已取消")
+                started = time.time()
+                data = response.raw.read(chunk, decode_content=True)
+                if not data:
+                    break
+                f.write(data)
+                throttle.update(len(data))
+                # 一次读取耗时过短说明块太小，耗时过长则降低块大小以保持进度和取消的响应速度
+                elapsed = time.time() - started
+                if elapsed < 0.05 and chunk < self.MAX_CHUNK:
+                    chunk *= 2
+                elif elapsed > 0.5 and chunk > self.MIN_CHUNK:
+                    chunk //= 2
+
+    def run(self):
+        """执行下载，校验失败或下载失败时抛出IOError"""
+        total, ranged = self._probe()
+        segments = self._segments(total) if ranged else [(0, 0, None)]
+        if not ranged and os.path.exists(self._part_path(0)):
+            os.remove(self._part_path(0))  # 服务器不支持续传，之前的残留分段无法使用
+        already = sum(os.path.getsize(self._part_path(i)) for i, _, _ in segments if os.path.exists(self._part_path(i)))
+        throttle = ProgressThrottle(self.progress, total)
+        throttle.update(already if ranged else 0, force=True)
+
+        if len(segments) == 1:
+            self._fetch_segment(*segments[0], throttle)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(segments)) as pool:
+                futures = [pool.submit(self._fetch_segment, i, start, end, throttle) for i, start, end in segments]
+                for future in futures:
+                    future.result()
+        throttle.update(0, force=True)
+
+        # 拼接分段并计算校验和，校验通过后原子地替换为目标文件
+        digest = hashlib.sha256()
+        tmp_path = f"{self.dest}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as out:
+            for i, _, _ in segments:
+                with open(self._part_path(i), "rb") as part:
+                    for data in iter(lambda: part.read(self.MAX_CHUNK), b""):
+                        digest.update(data)
+                        out.write(data)
+        for i, _, _ in segments:
+            os.remove(self._part_path(i))
+        size = os.path.getsize(tmp_path)
+        if total and size != total:
+            os.remove(tmp_path)
+            raise IOError(f"下载文件大小不符: 期望 {total} 字节, 实际 {size} 字节")
+        if self.expected_sha256 and digest.hexdigest() != self.expected_sha256:
+            os.remove(tmp_path)
+            raise IOError(f"SHA-256校验失败: 期望 {self.expected_sha256}, 实际 {digest.hexdigest()}")
+        os.replace(tmp_path, self.dest)
+        return digest.hexdigest()
+
+
+class LeaseManager:
+    """基于共享文件系统锁文件的租约管理器
+
+    每个文件对应输出目录下 .leases 中的一个锁文件，由持有节点定期刷新修改时间作为心跳。
+    心跳超过 lease_ttl 秒未更新的锁视为持有节点已失效，其他节点可以接管。
+    处理完成后写入 .done 标记，其他节点据此跳过该文件。
+    每次获取时在锁文件中写入唯一令牌，心跳、写完成标记和删除锁之前都先确认令牌仍是自己的；
+    不一致说明租约已被其他节点接管，此时视为租约丢失，不再刷新、不写完成标记也不删除锁。
+    """
+
+    def __init__(self, lease_dir, node_id=None, lease_ttl=60):
+        self.lease_dir = lease_dir
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_ttl = lease_ttl
+        self.held = {}  # key -> (锁文件路径, 令牌)
+        self.lock = threading.Lock()
+        self.heartbeat_thread = None
+        self.stop_event = threading.Event()
+        os.makedirs(self.lease_dir, exist_ok=True)
+
+    def _key(self, rel_path):
+        return f"{stable_path_hash(rel_path):040x}"
+
+    def _lock_path(self, key):
+        return os.path.join(self.lease_dir, key + ".lock")
+
+    def _done_path(self, key):
+        return os.path.join(self.lease_dir, key + ".done")
+
+    def is_done(self, rel_path):
+        """检查文件是否已由某个节点处理完成"""
+        return os.path.exists(self._done_path(self._key(rel_path)))
+
+    def _create_lock(self, lock_path, rel_path, token):
+        # O_EXCL 在本地文件系统和 NFSv3+ 上都是原子的，只有一个节点能创建成功
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"node": self.node_id, "token": token, "path": rel_path, "acquired": time.time()}, f)
+
+    def _owns(self, lock_path, token):
+        """锁文件仍存在且其中是自己的令牌"""
+        try:
+            with open(lock_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("token") == token
+        except (OSError, ValueError):
+            return False
+
+    def _is_stale(self, lock_path):
+        try:
+            return time.time() - os.stat(lock_path).st_mtime > self.lease_ttl
+        except FileNotFoundError:
+            return True
+
+    def try_acquire(self, rel_path):
+        """尝试获取文件的租约，成功返回True；已完成或被其他存活节点持有时返回False"""
+        key = self._key(rel_path)
+        if os.path.exists(self._done_path(key)):
+            return False
+        lock_path = self._lock_path(key)
+        token = f"{self.node_id}-{uuid.uuid4().hex}"
+        for _ in range(2):
+            try:
+                self._create_lock(lock_path, rel_path, token)
+                break
+            except FileExistsError:
+                if not self._is_stale(lock_path):
+                    return False
+                # 接管过期租约：先把旧锁重命名为唯一名称，重命名是原子的，只有一个节点会成功
+                stale_path = f"{lock_path}.stale.{uuid.uuid4().hex[:8]}"
+                try:
+                    os.rename(lock_path, stale_path)
+                except OSError:
+                    return False
+                if not self._is_stale(stale_path):
+                    # 另一个节点已抢先接管并创建了新锁，被我们误改名，尝试恢复后放弃
+                    try:
+                        os.link(stale_path, lock_path)
+                    except OSError:
+                        pass
+                    self._remove(stale_path)
+                    return False
+                self._remove(stale_path)
+        else:
+            return False
+        # 获取锁和完成标记之间可能存在竞争，再确认一次
+        if os.path.exists(self._done_path(key)):
+            self._remove(lock_path)
+            return False
+        with self.lock:
+            self.held[key] = (lock_path, token)
+        self._ensure_heartbeat()
+        return True
+
+    def release(self, rel_path, done=False):
+        """释放租约，done为True时写入完成标记
+
+        租约已被其他节点接管时什么也不做并返回False，由接管的节点负责完成该文件。
+        """
+        key = self._key(rel_path)
+        with self.lock:
+            lock_path, token = self.held.pop(key, (None, None))
+        if not lock_path or not self._owns(lock_path, token):
+            return False
+        if done:
+            with open(self._done_path(key), "w", encoding="utf-8") as f:
+                json.dump({"node": self.node_id, "path": rel_path, "finished": time.time()}, f)
+        self._remove(lock_path)
+        return True
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _ensure_heartbeat(self):
+        if self.heartbeat_thread and self.heartbeat_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self.heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        interval = max(self.lease_ttl / 3, 1)
+        while not self.stop_event.wait(interval):
+            self._heartbeat()
+
+    def _heartbeat(self):
+        """刷新仍由自己持有的锁，已被接管的租约从held中移除"""
+        with self.lock:
+            held = list(self.held.items())
+        for key, (lock_path, token) in held:
+            if not self._owns(lock_path, token):
+                with self.lock:
+                    self.held.pop(key, None)
+                continue
+            try:
+                os.utime(lock_path)
+            except OSError:
+                pass
+
+    def close(self):
+        """停止心跳并释放所有未完成的租约"""
+        self.stop_event.set()
+        with self.lock:
+            held = list(self.held.values())
+            self.held.clear()
+        for lock_path, token in held:
+            if self._owns(lock_path, token):
+                self._remove(lock_path)
+
+
+def content_fingerprint(path, full_hash=False, samples=16, sample_size=64 * 1024):
+    """计算文件的内容指纹，用于识别换了文件名的重复输入
+
+    默认只读取少量数据：文件大小 + moov的BLAKE2哈希 + mdat中均匀抽取的若干段的哈希。
+    moov中包含每个样本的大小和偏移，加上抽样的媒体数据，足以区分不同的视频。
+    full_hash 为True时对整个文件计算BLAKE2哈希，结果可靠但需要完整读取一遍文件。
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=20)
+    if full_hash:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+                digest.update(chunk)
+        return f"full:{size}:{digest.hexdigest()}"
+
+    boxes = scan_top_level_boxes(path)
+    mdat_ranges = [(offset, box_size) for box_type, offset, box_size in boxes if box_type == "mdat"]
+    if not mdat_ranges:
+        mdat_ranges = [(0, size)]  # 无法解析box结构时在整个文件中抽样
+    mdat_total = sum(length for _, length in mdat_ranges)
+    with open(path, "rb") as f:
+        for box_type, offset, box_size in boxes:
+            if box_type == "moov":
+                f.seek(offset)
+                digest.update(f.read(box_size))
+        # 把所有mdat视为一段连续的数据，在其中等距取样
+        for i in range(samples):
+            position = mdat_total * i // samples
+            for offset, length in mdat_ranges:
+                if position < length:
+                    f.seek(offset + position)
+                    digest.update(f.read(min(sample_size, length - position)))
+                    break
+                position -= length
+    return f"{size}:{digest.hexdigest()}"
+
+
+def clone_file(src, dst, hardlink=False):
+    """创建dst作为src的副本而不复制数据：优先reflink（共享数据块，之后修改互不影响）
+
+    hardlink 为True时在不支持reflink的文件系统上改用硬链接；硬链接的两个路径是同一个文件，
+    对其中一个的原位修改（例如update_moov）也会出现在另一个中，因此需要显式开启。
+    返回使用的方式 "reflink" 或 "hardlink"，都不可用时抛出OSError。
+    """
+    if fcntl is not None and sys.platform.startswith("linux"):
+        FICLONE = 0x40049409
+        with open(src, "rb") as s:
+            fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                fcntl.ioctl(fd, FICLONE, s.fileno())
+                os.close(fd)
+                shutil.copystat(src, dst)
+                return "reflink"
+            except OSError:
+                os.close(fd)
+                os.remove(dst)
+    if not hardlink:
+        raise OSError(errno.EOPNOTSUPP, "文件系统不支持reflink")
+    os.link(src, dst)
+    return "hardlink"
+
+
+class DedupIndex:
+    """持久化的 内容指纹 -> 已处理输出文件 索引
+
+    以只追加的日志文件保存（每行一条JSON记录），可以在多次运行、多个进程或节点之间共享。
+    record只追加一行并持有共享锁；加载时持有排他锁读取全部记录，同一指纹以最后一条为准，
+    有重复或损坏的行时压缩重写，压缩期间其他进程的追加会等待，不会丢失。
+    查询未命中时先读取其他进程新追加的记录；命中时确认记录的输出文件仍然存在且大小未变，
+    否则视为失效记录。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self._inode = None  # 已读取的日志文件，被其他进程压缩替换后从头读取
+        self._position = 0  # 已读取到的位置
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.lock, self._file_lock(exclusive=True):
+            if self._read_new() > len(self.entries):
+                self._compact()
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive):
+        if fcntl is None:  # Windows：依赖O_APPEND单次写入的原子性，不做压缩保护
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _read_new(self):
+        """读取日志中尚未读取的记录，返回读取的行数"""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            st = os.fstat(f.fileno())
+            # 文件被替换或截短（例如被手工清空）时已读取的位置失效，从头读取
+            if st.st_ino != self._inode or st.st_size < self._position:
+                self._inode, self._position, self.entries = st.st_ino, 0, {}
+            f.seek(self._position)
+            data = f.read()
+        count = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if not line.endswith(b"\n"):
+                    break  # 其他进程正在写入的最后一行，下次再读
+                record = None  # 损坏的行，压缩时丢弃
+            self._position += len(line)
+            count += 1
+            if isinstance(record, dict) and "fingerprint" in record:
+                self.entries[record.pop("fingerprint")] = record
+        return count
+
+    def _compact(self):
+        # 先写临时文件再替换，中途中断也不会留下半个索引
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for fingerprint, entry in self.entries.items():
+                f.write(json.dumps(dict(entry, fingerprint=fingerprint), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._inode = os.stat(self.path).st_ino
+        self._position = os.path.getsize(self.path)
+
+    def lookup(self, fingerprint):
+        """返回与指纹对应的已处理输出文件路径，没有或已失效时返回None"""
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if not entry:
+                self._read_new()
+                entry = self.entries.get(fingerprint)
+        if not entry:
+            return None
+        try:
+            if os.path.getsize(entry["output"]) == entry["size"]:
+                return entry["output"]
+        except OSError:
+            pass
+        with self.lock:
+            self.entries.pop(fingerprint, None)
+        return None
+
+    def update_output(self, output_path):
+        """输出文件被修改后（见update_moov）按新的大小重新记录，否则之后的查询会把它当作失效记录"""
+        output_path = os.path.abspath(output_path)
+        with self.lock:
+            self._read_new()
+            fingerprints = [fp for fp, entry in self.entries.items() if entry["output"] == output_path]
+        for fingerprint in fingerprints:
+            self.record(fingerprint, output_path)
+
+    def record(self, fingerprint, output_path):
+        output_path = os.path.abspath(output_path)
+        entry = {"output": output_path, "size": os.path.getsize(output_path), "recorded": time.time()}
+        line = json.dumps(dict(entry, fingerprint=fingerprint), ensure_ascii=False) + "\n"
+        with self.lock:
+            self.entries[fingerprint] = entry
+            with self._file_lock(exclusive=False):
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    os.write(fd, line.encode("utf-8"))
+                finally:
+                    os.close(fd)
+
+
+class ConcurrencyController:
+    """控制同时处理的文件数
+
+    固定模式下并发数始终为 max_workers。自适应模式从1开始，按固定时间窗口统计
+    已完成文件的总吞吐量（MB/s）和单文件耗时，按AIMD方式调整：吞吐量随并发提升而
+    明显增长时加1；增长停滞说明已越过拐点，退回上一级并保持；吞吐量明显下降时
+    （例如共享NAS被拖慢）按比例减半。
+    """
+
+    def __init__(self, max_workers=1, adaptive=False, interval=5.0, gain_threshold=0.1, drop_threshold=0.2):
+        self.max_workers = max(1, max_workers)
+        self.adaptive = adaptive
+        self.limit = 1 if adaptive else self.max_workers
+        self.interval = interval
+        self.gain_threshold = gain_threshold
+        self.drop_threshold = drop_threshold
+        self.active = 0
+        self.cond = threading.Condition()
+        self.started = time.time()
+        self.window_start = self.started
+        self.window_bytes = 0
+        self.window_files = 0
+        self.window_latency = 0.0
+        self.total_bytes = 0
+        self.total_files = 0
+        self.total_latency = 0.0
+        self.first_result = None  # 第一个文件完成的时间
+        self.last_throughput = None  # 上一个窗口的吞吐量（字节/秒）
+        self.holding = False  # 已找到拐点，保持当前并发
+        self.history = []  # (经过秒数, 并发数, MB/s, 平均单文件耗时)
+
+    def acquire(self, stop_check=None):
+        """等待空闲的并发名额；stop_check返回True时放弃等待并返回False"""
+        with self.cond:
+            while self.active >= self.limit:
+                if stop_check and stop_check():
+                    return False
+                self.cond.wait(timeout=0.5)
+            self.active += 1
+            return True
+
+    def release(self, nbytes=None, latency=0.0):
+        """归还名额，并记录刚完成文件的字节数和耗时；nbytes为None表示没有实际处理文件"""
+        with self.cond:
+            self.active -= 1
+            if nbytes is None:
+                self.cond.notify_all()
+                return
+            self.window_bytes += nbytes
+            self.window_files += 1
+            self.window_latency += latency
+            self.total_bytes += nbytes
+            self.total_files += 1
+            self.total_latency += latency
+            if self.first_result is None:
+                self.first_result = time.time()
+            if self.adaptive:
+                self._maybe_adjust()
+            self.cond.notify_all()
+
+    def _maybe_adjust(self):
+        now = time.time()
+        elapsed = now - self.window_start
+        # 窗口内至少完成与当前并发数相同的文件，避免大文件导致的采样抖动
+        if elapsed < self.interval or self.window_files < self.limit:
+            return
+        throughput = self.window_bytes / elapsed
+        latency = self.window_latency / self.window_files
+        self.history.append((round(now - self.started, 1), self.limit, round(throughput / 1024 / 1024, 2), round(latency, 2)))
+        previous = self.last_throughput
+        if previous is None:
+            if self.limit < self.max_workers:
+                self.limit += 1
+        elif throughput < previous * (1 - self.drop_threshold):
+            # 乘性减小：吞吐量明显下降，说明存储已过载
+            self.limit = max(1, self.limit // 2)
+            self.holding = False
+        elif not self.holding and throughput > previous * (1 + self.gain_threshold):
+            # 加性增大：增加并发仍有收益
+            if self.limit < self.max_workers:
+                self.limit += 1
+        elif not self.holding and self.limit > 1:
+            # 增加并发没有带来收益，退回到拐点并保持
+            self.limit -= 1
+            self.holding = True
+        self.last_throughput = throughput
+        self.window_start = now
+        self.window_bytes = 0
+        self.window_files = 0
+        self.window_latency = 0.0
+
+    def metrics(self):
+        """返回用于运行指标的统计信息"""
+        elapsed = max(time.time() - self.started, 1e-6)
+        return {
+            "concurrency": self.limit,
+            "max_workers": self.max_workers,
+            "adaptive": self.adaptive,
+            "throughput_mb_s": round(self.total_bytes / elapsed / 1024 / 1024, 2),
+            "avg_file_seconds": round(self.total_latency / self.total_files, 2) if self.total_files else 0,
+            "elapsed_seconds": round(elapsed, 2),
+            "first_result_seconds": round(self.first_result - self.started, 2) if self.first_result else None,
+            "concurrency_history": list(self.history),
+        }
+
 
 class MP4MoovFixer:
-    def __init__(self, input_dir=None, output_dir="processed_videos", log_callback=None, progress_callback=None):
+    def __init__(self, input_dir=None, output_dir="processed_videos", log_callback=None, progress_callback=None,
+                 shard=None, claim=False, node_id=None, lease_ttl=60, ffmpeg_path=None, workers=1, adaptive=False,
+                 space_check=True, space_reserve=256 * 1024 * 1024, order="listdir", verbose=True,
+                 direct_io=False, engine="auto", io_threads=1, dedup_index=None, dedup_full_hash=False,
+                 dedup_hardlink=False, interleave=None, moov_padding=0, compact=False):
         self.input_dir = input_dir if input_dir else os.getcwd()
         self.output_dir = os.path.join(self.input_dir, output_dir)
-        self.ffmpeg_path = self._get_ffmpeg_path()
+        # 常驻服务中由调用方传入已找到的FFmpeg路径，避免每个任务都重新查找
+        self.ffmpeg_path = ffmpeg_path or self._get_ffmpeg_path()
+        self._ffmpeg_failed = False  # 本次运行中已下载失败，不再重复尝试
         self.log_callback = log_callback  # 用于UI日志更新的回调函数
         self.progress_callback = progress_callback  # 用于UI进度条更新的回调函数
         self.stop_flag = False  # 用于取消处理的标志
+        self.shard = shard  # (k, n) 元组，只处理按路径哈希分到第k片的文件
+        self.claim = claim  # 是否使用租约锁在多个节点之间动态分配文件
+        self.node_id = node_id
+        self.lease_ttl = lease_ttl
+        self.workers = workers  # 最大并发处理的文件数
+        self.adaptive = adaptive  # 是否根据实测吞吐量自动调整并发数
+        self.run_metrics = {}  # 最近一次process_files的运行指标
+        self.space_check = space_check  # 是否按输出卷剩余空间准入文件
+        self.space_reserve = space_reserve  # 输出卷上始终保留的字节数
+        self.order = order  # 文件处理顺序，见 SCHEDULE_POLICIES
+        self.verbose = verbose  # 是否把日志打印到控制台，作为库嵌入时可关闭
+        self.results = []  # 最近一次process_files中每个文件的FixResult
+        self.direct_io = direct_io  # 直接复制文件时使用O_DIRECT绕过页缓存，修复路径不受影响
+        self.engine = engine  # "auto"：优先原生移动moov，不支持时用FFmpeg；"native"/"ffmpeg"：只用一种
+        self.io_threads = io_threads  # 单个文件内部并行复制的线程数
+        # 内容去重索引（路径或DedupIndex），重复的输入直接链接到已处理的输出
+        self.dedup = DedupIndex(dedup_index) if isinstance(dedup_index, (str, os.PathLike)) else dedup_index
+        self.dedup_full_hash = dedup_full_hash  # 指纹使用整个文件的BLAKE2哈希
+        self.dedup_hardlink = dedup_hardlink  # 不支持reflink时用硬链接代替复制（各输出共享同一个文件）
+        self.interleave = interleave  # 按该时长（秒）重新交错音视频样本，None表示不交错
+        self.moov_padding = moov_padding  # 修复时在moov之后预留的free box字节数
+        self.compact = compact  # 去除填充box和未被样本引用的数据，布局为 ftyp、moov、mdat
+    
+    def _in_shard(self, rel_path):
+        """判断文件是否属于当前节点的分片"""
+        if not self.shard:
+            return True
+        k, n = self.shard
+        return stable_path_hash(rel_path) % n == k - 1
+    
+    def _shard_key(self, path):
+        """--files-from中的路径对应的分片键：与扫描目录时相同，使用相对于输入目录的路径"""
+        src = os.path.normpath(os.path.join(self.input_dir, path))
+        try:
+            return os.path.relpath(src, self.input_dir)
+        except ValueError:  # Windows上不在同一盘符
+            return src
     
     def _get_ffmpeg_path(self):
-        """获取FFmpeg可执行文件路径"""
+        """获取FFmpeg可执行文件路径，同一工作目录下只查找一次"""
+        cwd = os.getcwd()
+        with _ffmpeg_lock:
+            if cwd not in _ffmpeg_paths:
+                _ffmpeg_paths[cwd] = self._find_ffmpeg()
+            return _ffmpeg_paths[cwd]
+    
+    def _find_ffmpeg(self):
         # 优先使用系统环境变量中的ffmpeg
         ffmpeg_cmd = "ffmpeg" if sys.platform != "win32" else "ffmpeg.exe"
         if shutil.which(ffmpeg_cmd):
@@ -59,84 +1753,56 @@ class MP4MoovFixer:
                 
         return None
     
-    def _download_ffmpeg(self):
-        """下载并解压FFmpeg"""
+    def _download_ffmpeg(self, url=None, expected_sha256=None):
+        """下载并解压FFmpeg，下载结果保存在共享缓存目录中供后续运行和其他用户复用"""
         self._log("FFmpeg未找到，正在下载...")
         
-        # 根据操作系统选择下载链接
-        if sys.platform == "win32":
-            url = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
+        # 根据操作系统选择下载链接，也可以通过环境变量指定镜像地址
+        url = url or os.environ.get("MP4_MOOV_FIXER_FFMPEG_URL")
+        expected_sha256 = expected_sha256 or os.environ.get("MP4_MOOV_FIXER_FFMPEG_SHA256")
+        sha256_url = None
+        if not url:
+            if sys.platform not in FFMPEG_DOWNLOADS:  # Linux
+                self._log("Linux系统，请手动安装FFmpeg: sudo apt-get install ffmpeg")
+                return False
+            url, sha256_url = FFMPEG_DOWNLOADS[sys.platform]
+        is_zip = urlparse(url).path.lower().endswith(".zip")
+        if is_zip:
             extract_dir = os.path.join(os.getcwd(), "ffmpeg")
-        elif sys.platform == "darwin":
-            url = "https://evermeet.cx/ffmpeg/getrelease/darwin64/static/ffmpeg"
+        else:
             extract_dir = os.path.join(os.getcwd(), "ffmpeg", "bin")
-        else:  # Linux
-            self._log("Linux系统，请手动安装FFmpeg: sudo apt-get install ffmpeg")
-            sys.exit(1)
         
-        # 创建下载目录
+        # 创建下载目录和缓存目录
+        cache_dir = default_cache_dir()
         try:
             os.makedirs(extract_dir, exist_ok=True)
+            os.makedirs(cache_dir, exist_ok=True)
         except Exception as e:
             self._log(f"创建目录失败: {e}")
             return False
         
-        # 下载文件
         try:
-            if sys.platform == "win32":
-                zip_path = os.path.join(extract_dir, "ffmpeg.zip")
-                
-                # 检查是否有进度回调函数，如果有则使用GUI进度条，否则使用命令行进度条
-                with requests.get(url, stream=True) as r:
-                    total_size = int(r.headers.get('content-length', 0))
-                    downloaded_size = 0
-                    
-                    # 确保文件可以正确打开
-                    with open(zip_path, 'wb') as f:
-                        # 根据是否有GUI回调决定使用哪种进度更新方式
-                        if self.progress_callback:
-                            # GUI模式：使用回调函数更新进度
-                            self._log(f"开始下载FFmpeg ({total_size/1024/1024:.2f} MB)...")
-                            for data in r.iter_content(chunk_size=8192):  # 使用更大的块大小提高下载效率
-                                if self.stop_flag:
-                                    return False
-                                size = f.write(data)
-                                downloaded_size += size
-                                # 更新进度
-                                if total_size > 0:
-                                    progress_percent = (downloaded_size / total_size) * 100
-                                    self.progress_callback(progress_percent, f"正在下载FFmpeg: {downloaded_size/1024/1024:.2f} MB/{total_size/1024/1024:.2f} MB")
-                        else:
-                            # 命令行模式：使用tqdm进度条
-                            with tqdm(
-                                desc="下载FFmpeg",
-                                total=total_size,
-                                unit='iB',
-                                unit_scale=True,
-                                unit_divisor=1024,
-                            ) as pbar:
-                                for data in r.iter_content(chunk_size=8192):
-                                    if self.stop_flag:
-                                        return False
-                                    size = f.write(data)
-                                    pbar.update(size)
-                
+            if not expected_sha256 and sha256_url:
+                expected_sha256 = self._fetch_sha256(sha256_url)
+            archive_path = self._get_cached_download(url, cache_dir, expected_sha256)
+            if not archive_path:
+                return False
+            
+            ffmpeg_cmd = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
+            if is_zip:
                 # 解压文件
                 self._log("正在解压FFmpeg...")
                 if self.progress_callback:
                     self.progress_callback(90, "正在解压FFmpeg...")
                 
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                with zipfile.ZipFile(archive_path, 'r') as zip_ref:
                     zip_ref.extractall(extract_dir)
                 
-                # 删除zip文件
-                os.remove(zip_path)
-                
-                # 查找ffmpeg.exe所在的bin目录
+                # 查找ffmpeg可执行文件所在的bin目录
                 found = False
                 for root, dirs, files in os.walk(extract_dir):
-                    if "ffmpeg.exe" in files:
-                        self.ffmpeg_path = os.path.join(root, "ffmpeg.exe")
+                    if ffmpeg_cmd in files:
+                        self.ffmpeg_path = os.path.join(root, ffmpeg_cmd)
                         # 确保文件有执行权限
                         try:
                             os.chmod(self.ffmpeg_path, 0o755)
@@ -147,46 +1813,19 @@ class MP4MoovFixer:
                         break
                 
                 if not found:
-                    self._log("解压后未找到ffmpeg.exe")
+                    self._log(f"解压后未找到{ffmpeg_cmd}")
                     return False
                 
-            else:  # macOS
-                ffmpeg_path = os.path.join(extract_dir, "ffmpeg")
-                
-                with requests.get(url, stream=True) as r:
-                    total_size = int(r.headers.get('content-length', 0))
-                    downloaded_size = 0
-                    
-                    with open(ffmpeg_path, 'wb') as f:
-                        if self.progress_callback:
-                            self._log(f"开始下载FFmpeg ({total_size/1024/1024:.2f} MB)...")
-                            for data in r.iter_content(chunk_size=8192):
-                                if self.stop_flag:
-                                    return False
-                                size = f.write(data)
-                                downloaded_size += size
-                                if total_size > 0:
-                                    progress_percent = (downloaded_size / total_size) * 100
-                                    self.progress_callback(progress_percent, f"正在下载FFmpeg: {downloaded_size/1024/1024:.2f} MB/{total_size/1024/1024:.2f} MB")
-                        else:
-                            with tqdm(
-                                desc="下载FFmpeg",
-                                total=total_size,
-                                unit='iB',
-                                unit_scale=True,
-                                unit_divisor=1024,
-                            ) as pbar:
-                                for data in r.iter_content(chunk_size=8192):
-                                    if self.stop_flag:
-                                        return False
-                                    size = f.write(data)
-                                    pbar.update(size)
+            else:  # macOS：下载的就是可执行文件
+                ffmpeg_path = os.path.join(extract_dir, ffmpeg_cmd)
+                shutil.copyfile(archive_path, ffmpeg_path)
                 
                 # 确保文件有执行权限
                 os.chmod(ffmpeg_path, 0o755)
                 self.ffmpeg_path = ffmpeg_path
                 
             self._log(f"FFmpeg下载完成: {self.ffmpeg_path}")
+            _ffmpeg_paths[os.getcwd()] = self.ffmpeg_path
             if self.progress_callback:
                 self.progress_callback(100, "FFmpeg下载完成")
             return True
@@ -197,6 +1836,82 @@ class MP4MoovFixer:
             self._log(f"错误详情: {traceback.format_exc()}")
             return False
     
+    def _fetch_sha256(self, sha256_url):
+        """获取发布方提供的SHA-256校验值，获取失败时返回None"""
+        import requests
+        try:
+            r = requests.get(sha256_url, timeout=30)
+            r.raise_for_status()
+            value = r.text.split()[0].strip().lower()
+            if re.fullmatch(r"[0-9a-f]{64}", value):
+                return value
+        except (requests.RequestException, IndexError):
+            pass
+        self._log("无法获取FFmpeg的SHA-256校验值，将跳过校验", "WARNING")
+        return None
+    
+    def _get_cached_download(self, url, cache_dir, expected_sha256=None):
+        """返回缓存中校验通过的下载文件路径，缓存不存在或校验不一致时下载
+
+        多个进程（或用户）同时需要下载时，只有取得锁的进程下载，其余等待后直接使用缓存。
+        """
+        name = os.path.basename(urlparse(url).path) or "ffmpeg-download"
+        cache_path = os.path.join(cache_dir, name)
+        locks = LeaseManager(os.path.join(cache_dir, ".locks"), lease_ttl=60)
+        waiting_logged = False
+        try:
+            while not self.stop_flag:
+                if os.path.exists(cache_path):
+                    if not expected_sha256 or sha256_of_file(cache_path) == expected_sha256:
+                        self._log(f"使用缓存的FFmpeg下载文件: {cache_path}")
+                        return cache_path
+                if locks.try_acquire(name):
+                    try:
+                        if os.path.exists(cache_path):
+                            self._log("缓存文件与最新校验值不一致，重新下载", "WARNING")
+                        self._run_download(url, cache_path, expected_sha256)
+                        try:
+                            # 共享缓存目录中的文件需要其他用户可读
+                            os.chmod(cache_path, 0o664)
+                        except OSError:
+                            pass
+                        return cache_path
+                    finally:
+                        locks.release(name)
+                if not waiting_logged:
+                    self._log("其他进程正在下载FFmpeg，等待其完成...")
+                    waiting_logged = True
+                time.sleep(1)
+            return None
+        finally:
+            locks.close()
+    
+    def _run_download(self, url, dest, expected_sha256=None):
+        """使用分段下载器下载文件，进度更新经过节流后交给GUI回调或tqdm进度条"""
+        pbar = None
+        
+        def on_progress(done, total, delta):
+            nonlocal pbar
+            if self.progress_callback:
+                # GUI模式：使用回调函数更新进度
+                if total > 0:
+                    self.progress_callback(done / total * 100, f"正在下载FFmpeg: {done/1024/1024:.2f} MB/{total/1024/1024:.2f} MB")
+            else:
+                # 命令行模式：使用tqdm进度条
+                if pbar is None:
+                    from tqdm import tqdm
+                    pbar = tqdm(desc="下载FFmpeg", total=total or None, unit='iB', unit_scale=True, unit_divisor=1024)
+                pbar.update(delta)
+        
+        downloader = SegmentedDownloader(url, dest, expected_sha256=expected_sha256, progress=on_progress,
+                                         stop_check=lambda: self.stop_flag)
+        try:
+            digest = downloader.run()
+        finally:
+            if pbar is not None:
+                pbar.close()
+        self._log(f"下载完成，SHA-256: {digest}" + ("（已校验）" if expected_sha256 else ""))
+    
     def _is_moov_at_end(self, mp4_file):
         """检查MP4文件的moov原子是否在文件末尾"""
         try:
@@ -223,8 +1938,39 @@ class MP4MoovFixer:
         except Exception:
             return True  # 默认假设需要处理
     
-    def _fix_moov_position(self, input_file, output_file):
+    def _fix_moov_position(self, input_file, output_file, copier=None):
+        """将moov原子移到文件开头：优先在字节层面直接移动，文件结构不支持时使用FFmpeg"""
+        if self.engine != "ffmpeg":
+            try:
+                NativeRelocator(input_file, copier or self._copier(), self.moov_padding).write(output_file)
+                self._log(f"  - 已直接移动moov（未经FFmpeg重新封装）", "INFO")
+                return True
+            except NativeUnsupported as e:
+                if self.engine == "native":
+                    self._log(f"处理文件失败 {input_file}: 不支持的文件结构（{e}）", "ERROR")
+                    self._remove_partial_output(output_file)
+                    return False
+                self._log(f"  - 无法直接移动moov（{e}），改用FFmpeg", "INFO")
+            except Exception as e:
+                self._log(f"处理文件失败 {input_file}: {e}", "ERROR")
+                self._remove_partial_output(output_file)
+                return False
+        return self._fix_moov_ffmpeg(input_file, output_file)
+    
+    def _remove_partial_output(self, output_file):
+        """删除处理失败后可能残留的输出文件"""
+        if os.path.exists(output_file):
+            try:
+                os.remove(output_file)
+                self._log(f"已删除残留的输出文件: {output_file}")
+            except Exception as del_err:
+                self._log(f"无法删除残留的输出文件 {output_file}: {del_err}")
+    
+    def _fix_moov_ffmpeg(self, input_file, output_file):
         """使用FFmpeg将moov原子移到文件开头"""
+        if not self._require_ffmpeg():
+            self._log(f"处理文件失败 {input_file}: 需要FFmpeg但无法获取", "ERROR")
+            return False
         try:
             cmd = [self.ffmpeg_path, "-i", input_file, "-c", "copy", "-movflags", 
                    "+faststart", "-y", output_file]
@@ -262,12 +2008,7 @@ class MP4MoovFixer:
         except Exception as e:
             self._log(f"处理文件失败 {input_file}: {e}")
             # 删除可能残留的输出文件
-            if os.path.exists(output_file):
-                try:
-                    os.remove(output_file)
-                    self._log(f"已删除残留的输出文件: {output_file}")
-                except Exception as del_err:
-                    self._log(f"无法删除残留的输出文件 {output_file}: {del_err}")
+            self._remove_partial_output(output_file)
             return False
     
     def _check_needs_processing(self, mp4_file):
@@ -329,82 +2070,433 @@ class MP4MoovFixer:
             return True  # 出错时默认需要处理
     
     def process_files(self):
-        """处理所有MP4文件"""
+        """处理输入目录中的所有MP4文件，每个文件的结果保存在results中"""
         # 检查并下载FFmpeg
-        if not self.ffmpeg_path:
-            if not self._download_ffmpeg():
-                self._log("无法获取FFmpeg，程序退出", "ERROR")
-                return False
+        if not self._ensure_ffmpeg():
+            return False
         
         # 创建输出目录
         os.makedirs(self.output_dir, exist_ok=True)
         
-        # 获取所有MP4文件
-        mp4_files = [f for f in os.listdir(self.input_dir) if f.lower().endswith('.mp4')]
+        # 获取所有MP4文件，扫描时一并取得大小和修改时间供调度使用
+        stats = {}
+        with os.scandir(self.input_dir) as it:
+            for entry in it:
+                if entry.name.lower().endswith('.mp4') and entry.is_file():
+                    stats[entry.name] = entry.stat()
+        mp4_files = list(stats)
+        
+        # 按路径哈希分片，多个节点各自处理互不重叠的子集
+        if self.shard:
+            total_count = len(mp4_files)
+            mp4_files = [f for f in mp4_files if self._in_shard(f)]
+            self._log(f"分片 {self.shard[0]}/{self.shard[1]}: 分配到 {len(mp4_files)}/{total_count} 个文件", "INFO")
         
         if not mp4_files:
             self._log("没有找到MP4文件", "WARNING")
             return True
         
         self._log(f"找到 {len(mp4_files)} 个MP4文件，开始处理...", "INFO")
+        mp4_files = order_files(mp4_files, stats, self.order)
+        if self.order != "listdir":
+            self._log(f"调度策略: {self.order}", "INFO")
+        
+        # 空间预检：只读取box头部估算所需空间，与输出卷的剩余空间比较
+        estimates = {f: self._estimate(os.path.join(self.input_dir, f)) for f in mp4_files}
+        budget = None
+        if self.space_check:
+            budget = SpaceBudget(self.output_dir, self.space_reserve)
+            required = sum(estimates.values())
+            available = budget.available()
+            self._log(f"空间预检: 预计需要 {required/1024/1024:.2f} MB, 可用 {available/1024/1024:.2f} MB"
+                      f"（已扣除保留空间 {self.space_reserve/1024/1024:.2f} MB）", "INFO")
+            if required > available and self.order == "listdir":
+                # 未指定调度策略时，空间紧张就先处理小文件，使能完成的文件数量最多
+                self._log("输出卷空间不足以容纳全部文件，将改为按从小到大的顺序处理", "WARNING")
+                mp4_files.sort(key=lambda f: estimates[f])
+            elif required > available:
+                self._log(f"输出卷空间不足以容纳全部文件，保持调度策略 {self.order}，放不下的文件将被跳过", "WARNING")
         self._log("-" * 50)
         
-        # 处理每个文件
-        success_count = 0
-        fail_count = 0
-        skipped_count = 0
+        # 租约模式：通过输出目录中的锁文件在多个节点之间动态领取任务
+        leases = None
+        if self.claim:
+            leases = LeaseManager(os.path.join(self.output_dir, ".leases"), self.node_id, self.lease_ttl)
+            self._log(f"租约模式已启用，节点ID: {leases.node_id}", "INFO")
         
-        for i, mp4_file in enumerate(mp4_files):
-            if self.stop_flag:
-                self._log("处理已取消", "WARNING")
-                return False
-            
-            input_path = os.path.join(self.input_dir, mp4_file)
-            output_path = os.path.join(self.output_dir, mp4_file)
+        try:
+            return self._process_file_list(mp4_files, leases, budget, estimates)
+        finally:
+            if leases:
+                leases.close()
+    
+    def _ensure_ffmpeg(self):
+        """处理开始前确认FFmpeg可用，只在engine为"ffmpeg"时需要
+
+        auto模式下原生方式能处理的文件不需要FFmpeg，遇到原生方式不支持的文件时才由_require_ffmpeg获取。
+        """
+        if self.engine != "ffmpeg":
+            return True
+        if not self._require_ffmpeg():
+            self._log("无法获取FFmpeg，程序退出", "ERROR")
+            return False
+        return True
+    
+    def _require_ffmpeg(self):
+        """返回FFmpeg是否可用，未找到时下载；多个工作线程同时需要时只下载一次"""
+        if self.ffmpeg_path:
+            return True
+        with _ffmpeg_lock:
+            self.ffmpeg_path = _ffmpeg_paths.get(os.getcwd())
+            if not self.ffmpeg_path and not self._ffmpeg_failed:
+                self._ffmpeg_failed = not self._download_ffmpeg()
+        return bool(self.ffmpeg_path)
+    
+    def iter_process(self, paths, output_path_for=None, ordered=False):
+        """处理给定的文件，每处理完一个文件就产出对应的FixResult（按完成顺序）
+
+        paths 可以是任意可迭代对象（包括生成器），在处理过程中按需读取；相对路径相对于输入目录。
+        output_path_for(src) 返回输出路径，默认保存到输出目录下的同名文件。
+        ordered 为True时按paths的顺序产出结果，先完成的后续文件会暂存到前面的文件完成为止。
+        """
+        if not self._ensure_ffmpeg():
+            raise RuntimeError("无法获取FFmpeg")
+        os.makedirs(self.output_dir, exist_ok=True)
+        
+        def items():
+            for path in paths:
+                src = os.path.normpath(os.path.join(self.input_dir, path))
+                if output_path_for:
+                    try:
+                        dst = output_path_for(src)
+                    except ValueError as e:
+                        self._log(f"跳过 {src}: {e}", "ERROR")
+                        yield src, None, None  # 作为该文件的失败结果报告，不中断其余文件
+                        continue
+                    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+                else:
+                    dst = os.path.join(self.output_dir, os.path.basename(src))
+                yield src, dst, None
+        
+        total = len(paths) if hasattr(paths, "__len__") else None
+        # 与process_files相同，按输出卷剩余空间准入，边读边处理时逐个估算所需空间
+        budget = SpaceBudget(self.output_dir, self.space_reserve) if self.space_check else None
+        yield from self._iter_results(items(), budget=budget, total=total, ordered=ordered)
+    
+    def _iter_results(self, items, leases=None, budget=None, estimates=None, total=None, ordered=False):
+        """在工作线程中处理 (输入路径, 输出路径, 租约键) 序列，按完成顺序（ordered时按输入顺序）产出FixResult
+
+        并发数由ConcurrencyController控制，输出空间由SpaceBudget控制。结束后运行指标保存在run_metrics中。
+        """
+        results = queue.Queue()
+        worker_done = object()
+        pending = zip(itertools.count(1), items)
+        pending_lock = threading.Lock()
+        closed = threading.Event()  # 调用方提前停止迭代时通知工作线程不再领取新文件
+        failures = []  # 工作线程读取输入时遇到的异常
+        controller = ConcurrencyController(self.workers, self.adaptive)
+        if self.adaptive:
+            self._log(f"自适应并发已启用，最大并发数: {controller.max_workers}", "INFO")
+        elif controller.max_workers > 1:
+            self._log(f"并发处理，工作线程数: {controller.max_workers}", "INFO")
+        
+        def stopped():
+            return self.stop_flag or closed.is_set()
+        
+        def handle(i, src, dst, key):
+            name = os.path.basename(src)
+            if dst is None:
+                return FixResult(src, dst, error=OUTSIDE_OUTPUT)
+            if leases and not leases.try_acquire(key):
+                self._log(f"跳过 {name}: 已由其他节点完成或正在处理", "INFO")
+                return FixResult(src, dst, action="skipped", error=CLAIMED_ELSEWHERE)
             
             # 更新进度
-            progress_percent = (i + 1) / len(mp4_files) * 100
-            if self.progress_callback:
-                self.progress_callback(progress_percent, f"处理中: {mp4_file}")
+            if self.progress_callback and total:
+                self.progress_callback(i / total * 100, f"处理中: {name}")
             
             # 文件处理开始标记
-            self._log(f"开始处理文件 ({i+1}/{len(mp4_files)}): {mp4_file}", "INFO")
+            self._log(f"开始处理文件 ({i}/{total or '?'}): {name}", "INFO")
             
-            # 检查是否需要处理
-            needs_processing = self._check_needs_processing(input_path)
+            # 等待输出卷有足够空间；没有其他文件在写入时仍放不下则跳过
+            estimate = (estimates or {}).get(key)
+            if budget and estimate is None:
+                estimate = self._estimate(src)
+            if budget and not budget.admit(dst, estimate, stopped):
+                self._log(f"  - 结果: 输出卷剩余空间不足，跳过", "ERROR")
+                if leases:
+                    leases.release(key)
+                return FixResult(src, dst, error=NO_SPACE)
+            try:
+                result = self.fix_file(src, dst)
+            finally:
+                if budget:
+                    budget.release(dst)
             
-            if needs_processing:
-                # 需要处理，使用FFmpeg修复
-                self._log(f"  - 状态: 需要修复moov原子位置", "INFO")
-                if self._fix_moov_position(input_path, output_path):
-                    success_count += 1
-                    self._log(f"  - 结果: 修复成功", "SUCCESS")
-                else:
-                    fail_count += 1
-                    self._log(f"  - 结果: 修复失败", "ERROR")
-            else:
-                # 不需要处理，直接复制到输出目录
-                self._log(f"  - 状态: 无需修复，直接复制", "INFO")
-                try:
-                    shutil.copy2(input_path, output_path)
-                    skipped_count += 1
-                    self._log(f"  - 结果: 复制成功", "SUCCESS")
-                except Exception as e:
-                    self._log(f"  - 结果: 复制失败 - {str(e)}", "ERROR")
-                    fail_count += 1
+            if leases and not leases.release(key, done=result.ok):
+                self._log(f"  - 租约已被其他节点接管，不标记为完成: {name}", "WARNING")
             
             # 文件处理结束分隔符
             self._log("-" * 30)
-            
+            return result
+        
+        def worker():
+            try:
+                while not stopped():
+                    if not controller.acquire(stopped):
+                        return
+                    start = time.time()
+                    result = None
+                    try:
+                        # 读取输入（例如生成器或标准输入）出错时同样要释放并发名额
+                        with pending_lock:
+                            item = next(pending, None)
+                        if item is None:
+                            return
+                        i, (src, dst, key) = item
+                        try:
+                            result = handle(i, src, dst, key)
+                        except Exception as e:
+                            self._log(f"处理文件时发生错误 {src}: {e}", "ERROR")
+                            result = FixResult(src, dst, error=str(e))
+                    finally:
+                        nbytes = result.bytes_read if result and result.action != "skipped" else None
+                        controller.release(nbytes, time.time() - start)
+                    results.put((i, result))
+            except Exception as e:
+                # 交给调用方的迭代重新抛出，其余工作线程不再领取新文件
+                self._log(f"读取待处理文件列表时发生错误: {e}", "ERROR")
+                failures.append(e)
+                closed.set()
+            finally:
+                results.put(worker_done)
+        
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(controller.max_workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            running = len(threads)
+            waiting = {}  # ordered模式下已完成、等待前面文件的结果
+            next_index = 1
+            while running:
+                item = results.get()
+                if item is worker_done:
+                    running -= 1
+                elif not ordered:
+                    yield item[1]
+                else:
+                    waiting[item[0]] = item[1]
+                    while next_index in waiting:
+                        yield waiting.pop(next_index)
+                        next_index += 1
+            if failures:
+                raise failures[0]
+        finally:
+            closed.set()
+            for thread in threads:
+                thread.join()
+            self.run_metrics = controller.metrics()
+            self.run_metrics["order"] = self.order
+    
+    def _process_file_list(self, mp4_files, leases=None, budget=None, estimates=None):
+        """处理输入目录中的文件列表并汇总结果"""
+        items = [(os.path.join(self.input_dir, f), os.path.join(self.output_dir, f), f) for f in mp4_files]
+        self.results = []
+        for result in self._iter_results(items, leases, budget, estimates, total=len(items)):
+            self.results.append(result)
+        
         # 保存统计数据作为实例属性，以便UI可以访问
-        self.success_count = success_count
-        self.fail_count = fail_count
-        self.skipped_count = skipped_count
+        self.success_count = sum(1 for r in self.results if r.action == "fixed")
+        self.fail_count = sum(1 for r in self.results if r.action == "failed")
+        self.skipped_count = sum(1 for r in self.results if r.action == "copied")
+        self.duplicate_count = sum(1 for r in self.results if r.action == "duplicate")
+        self.run_metrics["duplicates"] = self.duplicate_count
+        claimed_elsewhere = sum(1 for r in self.results if r.error == CLAIMED_ELSEWHERE)
+        no_space = sum(1 for r in self.results if r.error == NO_SPACE)
+        self.run_metrics["skipped_no_space"] = no_space
+        self.run_metrics["sparse_bytes_skipped"] = sum(r.sparse_bytes for r in self.results)
+        self.run_metrics["bytes_saved"] = sum(r.bytes_saved for r in self.results)
+        
+        if self.stop_flag:
+            self._log("处理已取消", "WARNING")
+            return False
         
-        self._log(f"处理完成！成功修复: {success_count} 个文件, 直接复制: {skipped_count} 个文件, 失败: {fail_count} 个文件")
+        self._log(f"处理完成！成功修复: {self.success_count} 个文件, 直接复制: {self.skipped_count} 个文件, 失败: {self.fail_count} 个文件")
+        if leases:
+            self._log(f"由其他节点处理: {claimed_elsewhere} 个文件")
+        if no_space:
+            self._log(f"因输出空间不足跳过: {no_space} 个文件", "WARNING")
+        if self.duplicate_count:
+            self._log(f"内容重复、直接使用已有输出: {self.duplicate_count} 个文件")
+        self._log(f"吞吐量: {self.run_metrics['throughput_mb_s']} MB/s, 并发数: {self.run_metrics['concurrency']}")
+        if self.compact:
+            self._log(f"紧凑布局共节省: {self.run_metrics['bytes_saved']/1024/1024:.2f} MB")
+        if self.run_metrics["sparse_bytes_skipped"]:
+            self._log(f"稀疏文件空洞未读写: {self.run_metrics['sparse_bytes_skipped']/1024/1024:.2f} MB")
         self._log(f"处理后的文件保存在: {self.output_dir}")
         return True
     
+    def _estimate(self, src):
+        """估算处理src需要的输出空间，包括moov之后的预留空间"""
+        return estimate_output_size(src) + self.moov_padding
+    
+    def _copier(self):
+        return BulkCopier(direct_io=self.direct_io, threads=self.io_threads)
+    
+    def fix_file(self, src, dst):
+        """处理单个文件：moov在后则修复，否则直接复制，返回FixResult"""
+        result = FixResult(src, dst)
+        started = time.time()
+        if os.path.abspath(src) == os.path.abspath(dst):
+            result.error = "输出路径与输入文件相同"
+            self._log(f"  - 结果: {result.error}", "ERROR")
+            return result
+        result.layout = detect_layout(src)
+        try:
+            result.bytes_read = os.path.getsize(src)
+        except OSError as e:
+            result.error = str(e)
+            self._log(f"  - 结果: 无法读取输入文件 - {e}", "ERROR")
+            return result
+        
+        fingerprint = None
+        if self.dedup is not None:
+            try:
+                fingerprint = content_fingerprint(src, self.dedup_full_hash)
+                existing = self.dedup.lookup(fingerprint)
+            except OSError as e:
+                self._log(f"  - 无法计算内容指纹，按普通文件处理: {e}", "WARNING")
+                existing = None
+            result.durations["fingerprint"] = round(time.time() - started, 3)
+            if existing and self._link_duplicate(existing, dst, result):
+                result.durations["total"] = round(time.time() - started, 3)
+                return result
+        
+        # 检查是否需要处理：box头部能确定布局时不必调用FFmpeg
+        check_started = time.time()
+        if self.engine == "native":
+            needs_processing = result.layout != "faststart"
+        elif self.engine == "auto" and result.layout in ("faststart", "moov-at-end"):
+            needs_processing = result.layout == "moov-at-end"
+            if not needs_processing:
+                self._log(f"文件已经是faststart格式: {os.path.basename(src)}", "INFO")
+        elif self._require_ffmpeg():
+            needs_processing = self._check_needs_processing(src)
+        else:
+            # 没有FFmpeg时无法检查，先尝试原生方式移动moov
+            needs_processing = True
+        result.durations["check"] = round(time.time() - check_started, 3)
+        
+        # 去重产生的硬链接与其他输出共享数据，先解除链接再写入，避免覆盖另一个输出
+        try:
+            if os.stat(dst).st_nlink > 1:
+                os.remove(dst)
+        except OSError:
+            pass
+        
+        stage_started = time.time()
+        copier = self._copier()
+        if ((self.interleave or self.compact) and self.engine != "ffmpeg"
+                and self._rewrite_mdat(src, dst, copier, result, needs_processing)):
+            result.durations["rewrite"] = round(time.time() - stage_started, 3)
+        elif needs_processing:
+            # 需要处理，修复moov位置
+            self._log(f"  - 状态: 需要修复moov原子位置", "INFO")
+            if self._fix_moov_position(src, dst, copier):
+                result.action = "fixed"
+                self._log(f"  - 结果: 修复成功", "SUCCESS")
+            else:
+                result.error = "FFmpeg修复失败或输出文件大小异常"
+                self._log(f"  - 结果: 修复失败", "ERROR")
+            result.durations["fix"] = round(time.time() - stage_started, 3)
+        else:
+            # 不需要处理，直接复制到输出目录
+            self._log(f"  - 状态: 无需修复，直接复制", "INFO")
+            try:
+                copier.copy_file(src, dst)
+                result.action = "copied"
+                self._log(f"  - 结果: 复制成功", "SUCCESS")
+            except Exception as e:
+                result.error = str(e)
+                self._log(f"  - 结果: 复制失败 - {str(e)}", "ERROR")
+                self._remove_partial_output(dst)
+            result.durations["copy"] = round(time.time() - stage_started, 3)
+        
+        if result.ok:
+            result.sparse_bytes = copier.sparse_bytes
+            result.bytes_written = os.path.getsize(dst) - result.sparse_bytes
+            if fingerprint:
+                self.dedup.record(fingerprint, dst)
+            # FFmpeg的读写不经过BulkCopier，处理完成后把输入输出从页缓存中移除
+            if "fix" in result.durations:
+                drop_file_cache(dst, written=True)
+        drop_file_cache(src)
+        result.durations["total"] = round(time.time() - started, 3)
+        return result
+    
+    def _rewrite_mdat(self, src, dst, copier, result, needs_processing):
+        """按采样表重建mdat（重新交错和/或紧凑布局）并移动moov，成功写出时返回True
+
+        文件结构不支持，或moov已在开头且重建既不能减少启动缓冲也不能减小文件时返回False，按普通流程处理。
+        """
+        try:
+            if self.interleave:
+                rewriter = SampleInterleaver(src, copier, self.interleave, self.moov_padding, self.compact)
+            else:
+                rewriter = MdatRewriter(src, copier, self.moov_padding, compact=True)
+            if not needs_processing:
+                improves = self.interleave and rewriter.buffer_before() > rewriter.buffer_after()
+                shrinks = self.compact and rewriter.output_size() < result.bytes_read
+                if not (improves or shrinks):
+                    self._log("  - 样本交错和文件布局已满足要求，无需重建", "INFO")
+                    return False
+            if self.interleave:
+                self._log(f"  - 状态: 按 {self.interleave * 1000:.0f}ms 重新交错样本", "INFO")
+            if self.compact:
+                self._log("  - 状态: 紧凑布局，去除填充box和未被引用的数据", "INFO")
+            rewriter.write(dst)
+        except NativeUnsupported as e:
+            self._log(f"  - 无法按采样表重建（{e}），按普通流程处理", "WARNING")
+            self._remove_partial_output(dst)
+            return False
+        except OSError as e:
+            self._remove_partial_output(dst)
+            result.error = str(e)
+            self._log(f"  - 结果: 重建失败 - {e}", "ERROR")
+            return True
+        result.action = "fixed"
+        if self.interleave:
+            result.interleave = rewriter.report()
+            self._log(f"  - 结果: 重新交错完成，启动缓冲 {result.interleave['before'] / 1024:.0f}KB"
+                      f"({result.interleave['before_seconds']}s) -> {result.interleave['after'] / 1024:.0f}KB"
+                      f"({result.interleave['after_seconds']}s)", "SUCCESS")
+        if self.compact:
+            # moov之后的预留空间是有意增加的，不计入；co64升级使moov变大时不会出现负数
+            result.bytes_saved = max(0, result.bytes_read - (os.path.getsize(dst) - rewriter.padding))
+            self._log(f"  - 结果: 紧凑布局完成，节省 {result.bytes_saved / 1024:.1f}KB", "SUCCESS")
+        return True
+    
+    def _link_duplicate(self, existing, dst, result):
+        """用已处理的输出满足内容重复的输入：reflink，不支持时复制已有输出（dedup_hardlink时改用硬链接）"""
+        if os.path.abspath(existing) == os.path.abspath(dst):
+            method = "existing"  # 同一输出已是处理结果
+        else:
+            try:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                try:
+                    method = clone_file(existing, dst, self.dedup_hardlink)
+                except OSError:
+                    method = "copy"  # 跨文件系统等情况
+                    result.bytes_written = self._copier().copy_file(existing, dst)
+            except OSError as e:
+                self._log(f"  - 链接已有输出失败，按普通文件处理: {e}", "WARNING")
+                return False
+        result.action = "duplicate"
+        result.duplicate_of = existing
+        self._log(f"  - 结果: 内容与已处理的 {os.path.basename(existing)} 相同，已{DEDUP_METHODS[method]}输出", "SUCCESS")
+        return True
+    
     def _log(self, message, level="INFO"):
         """记录日志，同时更新UI（如果有）"""
         # 添加时间戳和日志级别
@@ -421,7 +2513,8 @@ class MP4MoovFixer:
         formatted_message = f"[{timestamp}] {level_prefix} {message}"
         
         # 打印到控制台
-        print(formatted_message)
+        if self.verbose:
+            print(formatted_message)
         
         # 如果有UI回调，更新UI
         if self.log_callback:
@@ -436,6 +2529,594 @@ class MP4MoovFixer:
         """取消正在进行的处理"""
         self.stop_flag = True
 
+class FixJob:
+    """服务模式中的单个修复任务"""
+
+    FINAL_STATES = ("fixed", "copied", "duplicate", "failed", "cancelled")
+
+    def __init__(self, job_id, input_path, output_path, priority=0):
+        self.id = job_id
+        self.input_path = input_path
+        self.output_path = output_path
+        self.priority = priority
+        self.state = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None  # 任务结束后的FixResult
+        self.queue_entry = None  # 在服务队列中的条目，取消时用于移出队列
+        self.events = []  # 按时间顺序记录的事件，供进度流读取
+        self.cond = threading.Condition()
+        self.add_event("state", state="queued")
+
+    @property
+    def done(self):
+        return self.state in self.FINAL_STATES
+
+    def add_event(self, event_type, **fields):
+        """追加一个事件并唤醒等待中的进度流"""
+        with self.cond:
+            self.events.append(dict(fields, type=event_type, time=time.time()))
+            self.cond.notify_all()
+
+    def set_state(self, state):
+        self.state = state
+        if state == "running":
+            self.started = time.time()
+        elif state in self.FINAL_STATES:
+            self.finished = time.time()
+        self.add_event("state", state=state)
+
+    def progress(self):
+        """根据输出文件已写入的字节数估算进度（0-100）"""
+        if self.state in ("fixed", "copied", "duplicate"):
+            return 100.0
+        if self.state != "running":
+            return 0.0
+        try:
+            total = os.path.getsize(self.input_path)
+            written = os.path.getsize(self.output_path)
+        except OSError:
+            return 0.0
+        return min(written / total * 100, 99.9) if total else 0.0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "input": self.input_path,
+            "output": self.output_path,
+            "priority": self.priority,
+            "state": self.state,
+            "progress": round(self.progress(), 1),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result.to_dict() if self.result else None,
+        }
+
+
+class FixJobService:
+    """常驻的修复任务队列服务
+
+    FFmpeg路径在进程内只查找一次，原生方式不支持某个文件时才下载；由固定数量的工作线程从有界优先级队列中取任务处理。
+    队列已满时 submit 抛出 queue.Full，由HTTP层转换为503响应实现背压。
+    已结束的任务在 job_ttl 秒后，或已结束的任务超过 max_finished 个时从最早的开始移除。
+    """
+
+    def __init__(self, workers=2, queue_size=100, output_dir="processed_videos", ffmpeg_path=None, log_callback=None,
+                 job_ttl=3600, max_finished=1000):
+        self.workers = max(1, workers)
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self.output_dir = output_dir
+        self.ffmpeg_path = ffmpeg_path
+        self.log_callback = log_callback
+        self.queue = queue.PriorityQueue(maxsize=queue_size)
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    def start(self):
+        """准备FFmpeg并启动工作线程，FFmpeg不可用时返回False"""
+        fixer = MP4MoovFixer(ffmpeg_path=self.ffmpeg_path, log_callback=self.log_callback)
+        if not fixer._ensure_ffmpeg():
+            fixer._log("无法获取FFmpeg，服务无法启动", "ERROR")
+            return False
+        self.ffmpeg_path = fixer.ffmpeg_path
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"fix-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return True
+
+    def submit(self, input_path, output_path=None, priority=0):
+        """提交任务，priority越大越先处理；队列已满时抛出queue.Full"""
+        input_path = os.path.abspath(input_path)
+        if not os.path.isfile(input_path):
+            raise ValueError(f"输入文件不存在: {input_path}")
+        if not output_path:
+            output_path = os.path.join(os.path.dirname(input_path), self.output_dir, os.path.basename(input_path))
+        job = FixJob(uuid.uuid4().hex[:12], input_path, os.path.abspath(output_path), priority)
+        self._evict_finished()
+        with self.jobs_lock:
+            # 先入队再登记，入队失败（队列已满）时不留下任务记录
+            job.queue_entry = (-priority, next(self.sequence), job.id)
+            self.queue.put_nowait(job.queue_entry)
+            self.jobs[job.id] = job
+        return job
+
+    def _evict_finished(self):
+        """移除超过保留时间或超出数量上限的已结束任务"""
+        now = time.time()
+        with self.jobs_lock:
+            finished = sorted((job for job in self.jobs.values() if job.done), key=lambda job: job.finished)
+            excess = len(finished) - self.max_finished
+            for i, job in enumerate(finished):
+                if i < excess or now - job.finished > self.job_ttl:
+                    del self.jobs[job.id]
+
+    def get(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self.jobs_lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """取消尚未开始的任务，成功返回True"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        with job.cond:
+            if job.state != "queued":
+                return False
+            job.set_state("cancelled")
+        # 从队列中移除，释放占用的名额
+        with self.queue.mutex:
+            try:
+                self.queue.queue.remove(job.queue_entry)
+            except ValueError:
+                return True  # 工作线程已取出，会因状态不是queued而跳过
+            heapq.heapify(self.queue.queue)
+            self.queue.unfinished_tasks -= 1
+            if not self.queue.unfinished_tasks:
+                self.queue.all_tasks_done.notify_all()
+            self.queue.not_full.notify()
+        return True
+
+    def _worker_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                _, _, job_id = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            job = self.get(job_id)
+            try:
+                if job:
+                    # 与cancel互斥地从queued转为running
+                    with job.cond:
+                        if job.state != "queued":
+                            continue
+                        job.set_state("running")
+                    self._run_job(job)
+            finally:
+                self.queue.task_done()
+
+    def _run_job(self, job):
+        fixer = MP4MoovFixer(
+            input_dir=os.path.dirname(job.input_path),
+            output_dir=os.path.dirname(job.output_path),
+            log_callback=lambda message: job.add_event("log", message=message),
+            ffmpeg_path=self.ffmpeg_path,
+            verbose=False
+        )
+        try:
+            os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+            job.result = fixer.fix_file(job.input_path, job.output_path)
+        except Exception as e:
+            job.add_event("log", message=f"处理任务时发生错误: {e}")
+            job.result = FixResult(job.input_path, job.output_path, error=str(e))
+        job.set_state(job.result.action)
+        self._evict_finished()
+
+    def stop(self):
+        """停止所有工作线程（正在处理的任务会先完成）"""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+
+
+class FixJobRequestHandler(http.server.BaseHTTPRequestHandler):
+    """服务模式的HTTP接口
+
+    POST   /jobs              提交任务，请求体为 {"path": ..., "output": ..., "priority": ...}
+    GET    /jobs              列出所有任务
+    GET    /jobs/<id>         查询任务状态
+    GET    /jobs/<id>/events  以换行分隔的JSON流式返回任务事件和进度，直到任务结束
+    DELETE /jobs/<id>         取消排队中的任务
+    GET    /health            健康检查
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        # Unix套接字没有客户端地址，而且服务日志不需要记录每个请求
+        pass
+
+    def _send_json(self, code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path_parts(self):
+        return [part for part in urlparse(self.path).path.split("/") if part]
+
+    def do_POST(self):
+        if self._path_parts() != ["jobs"]:
+            return self._send_json(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            job = self.service.submit(request["path"], request.get("output"), int(request.get("priority", 0)))
+        except queue.Full:
+            return self._send_json(503, {"error": "queue full"}, {"Retry-After": "1"})
+        except (KeyError, ValueError, TypeError) as e:
+            return self._send_json(400, {"error": str(e)})
+        self._send_json(202, job.to_dict())
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ["health"]:
+            return self._send_json(200, {"status": "ok", "queued": self.service.queue.qsize()})
+        if parts == ["jobs"]:
+            return self._send_json(200, [job.to_dict() for job in self.service.list_jobs()])
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get(parts[1])
+            if not job:
+                return self._send_json(404, {"error": "job not found"})
+            if len(parts) == 2:
+                return self._send_json(200, job.to_dict())
+            if parts[2] == "events":
+                return self._stream_events(job)
+        self._send_json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        parts = self._path_parts()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._send_json(404, {"error": "not found"})
+        if self.service.cancel(parts[1]):
+            return self._send_json(200, self.service.get(parts[1]).to_dict())
+        self._send_json(409, {"error": "job is not queued"})
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        last_progress = None
+        while True:
+            with job.cond:
+                if sent >= len(job.events) and not job.done:
+                    job.cond.wait(timeout=1.0)
+                events = job.events[sent:]
+                finished = job.done
+            for event in events:
+                self._write_chunk(event)
+            sent += len(events)
+            progress = round(job.progress(), 1)
+            if progress != last_progress and job.state == "running":
+                self._write_chunk({"type": "progress", "progress": progress, "time": time.time()})
+                last_progress = progress
+            if finished and sent >= len(job.events):
+                break
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FixJobHTTPServer(http.server.ThreadingHTTPServer):
+    """监听TCP端口的服务"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        super().__init__(address, FixJobRequestHandler)
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class FixJobUnixServer(socketserver.ThreadingUnixStreamServer):
+        """监听Unix套接字的服务，仅本机进程可访问"""
+
+        daemon_threads = True
+
+        def __init__(self, socket_path, service):
+            self.service = service
+            self._remove_stale_socket(socket_path)
+            super().__init__(socket_path, FixJobRequestHandler)
+
+        @staticmethod
+        def _remove_stale_socket(socket_path):
+            """删除上次运行遗留的套接字文件；路径是普通文件或已有服务在监听时抛出OSError"""
+            try:
+                mode = os.lstat(socket_path).st_mode
+            except FileNotFoundError:
+                return
+            if not stat.S_ISSOCK(mode):
+                raise OSError(errno.EEXIST, f"路径已存在且不是套接字: {socket_path}")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except ConnectionRefusedError:
+                os.remove(socket_path)  # 没有进程在监听，是遗留的套接字
+                return
+            finally:
+                probe.close()
+            raise OSError(errno.EADDRINUSE, f"已有服务在监听: {socket_path}")
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class FixJobClient:
+    """服务模式的本地客户端"""
+
+    def __init__(self, host="127.0.0.1", port=8765, socket_path=None, timeout=None):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.socket_path:
+            return _UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _request(self, method, path, payload=None):
+        conn = self._connection()
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            headers = {"Content-Type": "application/json"} if body else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read() or b"null")
+        finally:
+            conn.close()
+
+    def submit(self, path, output=None, priority=0):
+        """提交任务，返回 (HTTP状态码, 任务信息)；队列已满时状态码为503"""
+        return self._request("POST", "/jobs", {"path": path, "output": output, "priority": priority})
+
+    def status(self, job_id):
+        return self._request("GET", f"/jobs/{job_id}")[1]
+
+    def cancel(self, job_id):
+        return self._request("DELETE", f"/jobs/{job_id}")[1]
+
+    def events(self, job_id):
+        """逐个产出任务事件，任务结束后停止"""
+        conn = self._connection()
+        try:
+            conn.request("GET", f"/jobs/{job_id}/events")
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"获取任务事件失败: HTTP {response.status}")
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+    def wait(self, job_id):
+        """等待任务结束并返回最终状态"""
+        for _ in self.events(job_id):
+            pass
+        return self.status(job_id)
+
+
+def serve_main(argv):
+    """服务模式入口：python mp4_moov_fixer.py serve [选项]"""
+    parser = argparse.ArgumentParser(prog="mp4_moov_fixer.py serve", description='以常驻服务方式运行，通过本地HTTP接口提交修复任务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口，默认8765')
+    parser.add_argument('--socket', help='改为监听指定路径的Unix套接字')
+    parser.add_argument('--workers', type=int, default=2, help='工作线程数，默认2')
+    parser.add_argument('--queue-size', type=int, default=100, help='排队任务上限，队列满时提交返回503，默认100')
+    parser.add_argument('-o', '--output', default="processed_videos",
+                        help='未指定输出路径的任务保存到输入文件所在目录下的该子目录，默认为"processed_videos"')
+    args = parser.parse_args(argv)
+
+    service = FixJobService(workers=args.workers, queue_size=args.queue_size, output_dir=args.output)
+    if not service.start():
+        return False
+    try:
+        if args.socket:
+            server = FixJobUnixServer(args.socket, service)
+            address = args.socket
+        else:
+            server = FixJobHTTPServer((args.host, args.port), service)
+            address = f"http://{args.host}:{server.server_address[1]}"
+    except OSError as e:
+        print(f"无法启动服务: {e}", file=sys.stderr)
+        service.stop()
+        return False
+    print(f"服务已启动: {address}，工作线程: {service.workers}，队列上限: {args.queue_size}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("正在停止服务...")
+    finally:
+        server.server_close()
+        service.stop()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return True
+
+def read_path_list(stream):
+    """从二进制文件对象中逐个读取路径，数据一到达就产出，不必等待输入结束
+
+    自动识别分隔符：出现NUL时按NUL分隔（find -print0），否则按行分隔。空项被忽略。
+    """
+    read = getattr(stream, "read1", stream.read)
+    separator = None
+    buffer = b""
+    while True:
+        chunk = read(64 * 1024)
+        if not chunk:
+            break
+        buffer += chunk
+        if separator is None:
+            if b"\0" in buffer:
+                separator = b"\0"
+            elif b"\n" in buffer:
+                separator = b"\n"
+            else:
+                continue
+        *entries, buffer = buffer.split(separator)
+        for entry in entries:
+            if separator == b"\n":
+                entry = entry.rstrip(b"\r")
+            if entry:
+                yield os.fsdecode(entry)
+    buffer = buffer.rstrip(b"\r\n") if separator != b"\0" else buffer
+    if buffer:
+        yield os.fsdecode(buffer)
+
+
+OUTPUT_MAPPINGS = ("mirror", "flat")
+
+
+def make_output_mapper(output_dir, mapping="mirror", root=None):
+    """返回把输入路径映射为输出路径的函数
+
+    mirror：在输出目录下保留相对于root（默认当前目录）的目录结构，root之外的文件使用其完整路径；
+    flat：全部放在输出目录下，只保留文件名（同名文件会互相覆盖）；
+    其他含"{"的字符串视为模板，可用 {name}（文件名）、{stem}、{ext}（含点）、{parent}（所在目录名）、
+    {dir}（相对于root的目录）和 {relpath}，结果放在输出目录下。
+    规范化后不在输出目录中的结果（例如模板或路径中的".."、绝对路径模板）抛出ValueError；
+    未知的映射和无法格式化的模板（未知字段、位置字段、括号不匹配）在创建时抛出ValueError。
+    """
+    root = os.path.abspath(root or os.getcwd())
+
+    def relative(src):
+        try:
+            rel = os.path.relpath(src, root)
+        except ValueError:  # Windows上不在同一盘符
+            rel = os.pardir
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            rel = os.path.splitdrive(src)[1].lstrip("\\/")  # root之外的文件使用去掉盘符和根的完整路径
+        return rel
+
+    def mapper(src):
+        src = os.path.abspath(src)
+        if mapping == "flat":
+            dst = os.path.basename(src)
+        elif mapping == "mirror":
+            dst = relative(src)
+        else:
+            rel = relative(src)
+            stem, ext = os.path.splitext(os.path.basename(src))
+            dst = mapping.format(name=os.path.basename(src), stem=stem, ext=ext,
+                                 parent=os.path.basename(os.path.dirname(src)), dir=os.path.dirname(rel), relpath=rel)
+        base = os.path.abspath(output_dir)
+        dst = os.path.normpath(os.path.join(base, dst))
+        if dst == base or os.path.commonpath([base, dst]) != base:
+            raise ValueError(f"{OUTSIDE_OUTPUT}: {dst}")
+        return dst
+
+    if mapping not in OUTPUT_MAPPINGS and "{" not in mapping:
+        raise ValueError(f"未知的输出映射: {mapping}")
+    if mapping not in OUTPUT_MAPPINGS:
+        # 先用示例值格式化一次，模板错误在开始处理前报告，而不是在第一个文件上抛出KeyError
+        try:
+            mapping.format(name="a.mp4", stem="a", ext=".mp4", parent="d", dir="d", relpath="d/a.mp4")
+        except KeyError as e:
+            raise ValueError(f"无效的输出映射模板 {mapping}: 未知字段 {{{e.args[0]}}}") from e
+        except IndexError as e:
+            raise ValueError(f"无效的输出映射模板 {mapping}: 不支持位置字段 {{}}") from e
+        except (ValueError, AttributeError) as e:
+            raise ValueError(f"无效的输出映射模板 {mapping}: {e}") from e
+    return mapper
+
+
+def fix_file(src, dst, **opts):
+    """修复单个MP4文件并返回FixResult，供其他Python程序直接调用
+
+    opts 为 MP4MoovFixer 的构造参数，例如 ffmpeg_path、log_callback；默认不向控制台打印日志。
+    """
+    opts.setdefault("verbose", False)
+    fixer = MP4MoovFixer(input_dir=os.path.dirname(os.path.abspath(src)), **opts)
+    if not fixer._ensure_ffmpeg():
+        return FixResult(src, dst, error="无法获取FFmpeg")
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    return fixer.fix_file(src, dst)
+
+
+def iter_process(paths, output_dir="processed_videos", output_path_for=None, ordered=False, **opts):
+    """批量处理文件，每完成一个文件就产出一个FixResult（ordered为True时按paths的顺序）
+
+    opts 为 MP4MoovFixer 的构造参数，例如 workers、adaptive、ffmpeg_path；默认不向控制台打印日志。
+    """
+    opts.setdefault("verbose", False)
+    fixer = MP4MoovFixer(output_dir=output_dir, **opts)
+    yield from fixer.iter_process(paths, output_path_for, ordered)
+
+
+def run_files_from(fixer, source, mapping="mirror"):
+    """--files-from模式：从文件或标准输入流式读取路径并处理，按输入顺序逐行输出JSON结果
+
+    全部成功时返回True。
+    """
+    mapper = make_output_mapper(fixer.output_dir, mapping, fixer.input_dir)
+    stream = sys.stdin.buffer if source == "-" else open(source, "rb")
+    paths = (path for path in read_path_list(stream) if fixer._in_shard(fixer._shard_key(path)))
+    all_ok = True
+    try:
+        for result in fixer.iter_process(paths, mapper, ordered=True):
+            all_ok = all_ok and result.ok
+            print(json.dumps(result.to_dict(), ensure_ascii=False), flush=True)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+    return all_ok
+
+
+def load_gui():
+    """导入tkinter，环境中没有图形界面支持时返回False"""
+    global tk, filedialog, ttk, scrolledtext, messagebox
+    try:
+        import tkinter as tk
+        from tkinter import filedialog, ttk, scrolledtext, messagebox
+    except ImportError:
+        return False
+    return True
+
+
 class MP4MoovFixerApp:
     def __init__(self, root):
         self.root = root
@@ -727,20 +3408,96 @@ class MP4MoovFixerApp:
             messagebox.showwarning("警告", "输出文件夹不存在")
 
 def main():
+    # 服务模式
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_main(sys.argv[2:])
     # 检查参数，如果有命令行参数则使用命令行模式
-    if len(sys.argv) > 1:
+    elif len(sys.argv) > 1:
         parser = argparse.ArgumentParser(description='自动修复MP4文件的moov原子位置')
         parser.add_argument('-i', '--input', help='输入目录路径，默认为当前目录')
         parser.add_argument('-o', '--output', help='输出目录名称，默认为"processed_videos"')
+        parser.add_argument('--files-from', metavar='PATH|-',
+                            help='从文件或标准输入(-)读取要处理的路径（按行或NUL分隔），边读边处理，不扫描输入目录；'
+                                 '按输入顺序在标准输出中逐行输出JSON格式的结果')
+        parser.add_argument('--output-map', default='mirror', metavar='mirror|flat|TEMPLATE',
+                            help='--files-from的输出路径：mirror（默认，保留相对于输入目录的目录结构）、flat（只保留文件名）'
+                                 '或模板，例如 "{dir}/{stem}_fixed{ext}"，可用 name、stem、ext、parent、dir、relpath')
+        parser.add_argument('--shard', type=parse_shard, metavar='K/N',
+                            help='只处理按路径哈希分配到第K片（共N片）的文件，用于多节点并行')
+        parser.add_argument('--claim', action='store_true',
+                            help='租约模式：通过输出目录中的锁文件在多个节点之间动态领取文件')
+        parser.add_argument('--node-id', help='租约模式下的节点标识，默认为"主机名-进程号"')
+        parser.add_argument('--lease-ttl', type=float, default=60,
+                            help='租约心跳超时秒数，超时的租约可被其他节点接管，默认60')
+        parser.add_argument('-w', '--workers', type=int, default=1,
+                            help='同时处理的文件数，默认1；与--adaptive同用时为并发上限')
+        parser.add_argument('--adaptive', action='store_true',
+                            help='根据实测吞吐量(MB/s)自动调整并发数，寻找存储的吞吐拐点')
+        parser.add_argument('--order', choices=SCHEDULE_POLICIES, default="listdir",
+                            help='处理顺序：listdir（目录顺序，默认）、largest（大文件优先，并行时整批最快完成）、'
+                                 'smallest（小文件优先，最快得到首批结果）、mtime（按修改时间先到先处理）')
+        parser.add_argument('--engine', choices=("auto", "native", "ffmpeg"), default="auto",
+                            help='修复方式：auto（默认，直接移动moov，文件结构不支持时用FFmpeg）、native（只直接移动）、ffmpeg（只用FFmpeg）')
+        parser.add_argument('--compact', action='store_true',
+                            help='紧凑布局：去除free/skip/wide等填充box和mdat中未被样本引用的数据，输出为ftyp、moov、mdat')
+        parser.add_argument('--moov-padding', type=parse_size, default=0, metavar='SIZE',
+                            help='修复时在moov之后预留的free空间，例如 64K，之后用update_moov添加元数据不必重写文件')
+        parser.add_argument('--interleave', type=float, metavar='MS',
+                            help='按该时长（毫秒，例如500）重新交错音视频样本，减少渐进式播放前需要缓冲的数据，不解码')
+        parser.add_argument('--io-threads', type=int, default=1,
+                            help='单个文件内部并行复制的线程数，NVMe或网络文件系统上可设为4-16，默认1')
+        parser.add_argument('--direct-io', action='store_true',
+                            help='直接复制（无需修复）的文件使用O_DIRECT读写，完全不占用页缓存；移动moov和重建mdat时仍使用缓冲读写（仅Linux）')
+        parser.add_argument('--reserve', type=parse_size, default="256M",
+                            help='输出卷上始终保留的空间，例如 512M、10G，默认256M')
+        parser.add_argument('--no-space-check', action='store_true',
+                            help='不检查输出卷剩余空间')
+        parser.add_argument('--dedup-index', metavar='PATH',
+                            help='内容去重索引文件：内容相同的输入（即使文件名不同）直接reflink或复制已处理的输出')
+        parser.add_argument('--dedup-full-hash', action='store_true',
+                            help='去重指纹使用整个文件的BLAKE2哈希，而不是moov加mdat抽样')
+        parser.add_argument('--dedup-hardlink', action='store_true',
+                            help='不支持reflink时用硬链接代替复制，节省空间，但重复的输出是同一个文件')
         args = parser.parse_args()
+        if args.files_from and args.claim:
+            parser.error("--files-from 不能与 --claim 同时使用")
+        try:
+            make_output_mapper(args.output or "processed_videos", args.output_map, args.input)
+        except ValueError as e:
+            parser.error(str(e))
         
         fixer = MP4MoovFixer(
             input_dir=args.input,
-            output_dir=args.output if args.output else "processed_videos"
+            output_dir=args.output if args.output else "processed_videos",
+            shard=args.shard,
+            claim=args.claim,
+            node_id=args.node_id,
+            lease_ttl=args.lease_ttl,
+            workers=args.workers if not args.adaptive or args.workers > 1 else (os.cpu_count() or 4),
+            adaptive=args.adaptive,
+            space_check=not args.no_space_check,
+            space_reserve=args.reserve,
+            order=args.order,
+            direct_io=args.direct_io,
+            engine=args.engine,
+            io_threads=args.io_threads,
+            dedup_index=args.dedup_index,
+            dedup_full_hash=args.dedup_full_hash,
+            dedup_hardlink=args.dedup_hardlink,
+            interleave=args.interleave / 1000 if args.interleave else None,
+            moov_padding=args.moov_padding,
+            compact=args.compact,
+            verbose=not args.files_from  # 文件列表模式的标准输出只用于逐个输出结果
         )
+        if args.files_from:
+            sys.exit(0 if run_files_from(fixer, args.files_from, args.output_map) else 1)
         fixer.process_files()
     else:
         # 否则使用GUI模式
+        if not load_gui():
+            print("当前环境不支持图形界面（未安装tkinter或为无头版本），请使用命令行参数，例如: --input 目录")
+            print("使用 --help 查看全部参数")
+            sys.exit(2)
         root = tk.Tk()
         app = MP4MoovFixerApp(root)
         root.mainloop()
@@ -0,0 +1,222 @@
+"""构造测试用的合成MP4文件，并独立于被测代码读取每个样本的内容
+
+每个样本的内容由 (轨道序号, 样本序号) 生成，读取时与期望值逐字节比较，
+可以发现块偏移、分块表或数据复制中的任何错误。
+"""
+import mmap
+import struct
+
+DEFAULT_TRACKS = [
+    dict(handler="vide", timescale=1000, count=60, duration=40, size=3000, per_chunk=30),
+    dict(handler="soun", timescale=48000, count=100, duration=1024, size=400, per_chunk=50),
+]
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", len(payload) + 8, box_type.encode("latin-1")) + payload
+
+
+def full_box(box_type, payload, version=0, flags=0):
+    return box(box_type, struct.pack(">I", (version << 24) | flags) + payload)
+
+
+def sample_bytes(track, index, size):
+    pattern = struct.pack(">HI", track, index)
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+def _chunks(tracks, interleave):
+    chunks = []  # (轨道序号, 首个样本序号, 样本数)
+    for track_index, track in enumerate(tracks):
+        for first in range(0, track["count"], track["per_chunk"]):
+            chunks.append((track_index, first, min(track["per_chunk"], track["count"] - first)))
+    if interleave:
+        chunks.sort(key=lambda c: (c[1] * tracks[c[0]]["duration"] / tracks[c[0]]["timescale"], c[0]))
+    return chunks
+
+
+def _moov(tracks, chunks, chunk_offsets, co64, truncate=None):
+    traks = b""
+    for track_index, track in enumerate(tracks):
+        offsets = [chunk_offsets[i] for i, c in enumerate(chunks) if c[0] == track_index]
+        count, per_chunk = track["count"], track["per_chunk"]
+        stts = full_box("stts", struct.pack(">III", 1, count, track["duration"]))
+        if count % per_chunk:
+            stsc = full_box("stsc", struct.pack(">IIIIIII", 2, 1, per_chunk, 1, len(offsets), count % per_chunk, 1))
+        else:
+            stsc = full_box("stsc", struct.pack(">IIII", 1, 1, per_chunk, 1))
+        stsz = full_box("stsz", struct.pack(">II", 0, count) + struct.pack(">%dI" % count, *[track["size"]] * count))
+        if co64:
+            chunk_box = full_box("co64", struct.pack(">I", len(offsets)) + struct.pack(">%dQ" % len(offsets), *offsets))
+        else:
+            chunk_box = full_box("stco", struct.pack(">I", len(offsets)) + struct.pack(">%dI" % len(offsets), *offsets))
+        entry = "mp4v" if track["handler"] == "vide" else "mp4a"
+        stsd = full_box("stsd", struct.pack(">I", 1) + box(entry, b"\0" * 16))
+        tables = dict(stts=stts, stsc=stsc, stsz=stsz, chunk=chunk_box)
+        for box_type, removed in (truncate or {}).items():
+            # 只截短第一个轨道的表：box大小与剩余内容一致，但表项数大于实际存在的表项
+            if track_index == 0:
+                key = "chunk" if box_type in ("stco", "co64") else box_type
+                body = tables[key][8:len(tables[key]) - removed]
+                tables[key] = box(box_type, body)
+        stbl = box("stbl", stsd + tables["stts"] + tables["stsc"] + tables["stsz"] + tables["chunk"])
+        media_header = box("vmhd" if track["handler"] == "vide" else "smhd", b"\0" * 8)
+        minf = box("minf", media_header + box("dinf", b"") + stbl)
+        mdhd = full_box("mdhd", struct.pack(">IIIIHH", 0, 0, track["timescale"], count * track["duration"], 0, 0))
+        hdlr = full_box("hdlr", struct.pack(">I4s12s", 0, track["handler"].encode(), b"\0" * 12) + b"x\0")
+        traks += box("trak", box("tkhd", b"\0" * 84) + box("mdia", mdhd + hdlr + minf))
+    return box("moov", box("mvhd", b"\0" * 100) + traks)
+
+
+def make_mp4(path, tracks=None, layout="end", interleave=False, free=0, co64=False, mdat_count=1,
+             reverse_track=None, orphan=0, trailing=b"", gap=0, truncate=None):
+    """写出合成MP4并返回轨道定义
+
+    layout 为 "end"（moov在mdat之后）或 "start"（faststart）；free 为在mdat之前插入的free box内容字节数；
+    mdat_count 把数据分成多个mdat；reverse_track 指定的轨道按与分块表相反的顺序存放（块偏移递减）；
+    orphan 为每个mdat末尾不属于任何样本的字节数；trailing 为文件末尾附加的无法解析的数据；
+    gap 为在最后一个mdat的最后一块之前留出的空洞字节数（稀疏写入），用于构造超过4GB的文件；
+    truncate 为 {box类型: 字节数}，把第一个轨道的该采样表截短若干字节，用于构造损坏的文件。
+    """
+    tracks = tracks or DEFAULT_TRACKS
+    chunks = _chunks(tracks, interleave)
+    stored = list(chunks)
+    if reverse_track is not None:
+        own = [c for c in stored if c[0] == reverse_track]
+        reversed_own = iter(reversed(own))
+        stored = [next(reversed_own) if c[0] == reverse_track else c for c in stored]
+    per_mdat = -(-len(stored) // mdat_count)
+    groups = [stored[i:i + per_mdat] for i in range(0, len(stored), per_mdat)]
+
+    ftyp = box("ftyp", b"isom\0\0\0\0isomiso2")
+    free_box = box("free", b"\0" * free) if free else b""
+    moov_size = len(_moov(tracks, chunks, [0] * len(chunks), co64, truncate))
+    position = len(ftyp) + len(free_box) + (moov_size if layout == "start" else 0)
+    offsets = {}
+    mdats = []  # bytes或表示空洞大小的整数
+    for n, group in enumerate(groups):
+        header = 16 if gap else 8  # 有空洞的mdat超过4GB，使用64位大小
+        payload = []
+        length = 0
+        for c, (track_index, first, count) in enumerate(group):
+            if gap and n == len(groups) - 1 and c == len(group) - 1:
+                payload.append(gap)
+                length += gap
+            offsets[(track_index, first)] = position + header + length
+            size = tracks[track_index]["size"]
+            data = b"".join(sample_bytes(track_index, first + k, size) for k in range(count))
+            payload.append(data)
+            length += len(data)
+        payload.append(b"\xee" * orphan)
+        length += orphan
+        if gap:
+            mdats.append(struct.pack(">I4sQ", 1, b"mdat", length + header))
+        else:
+            mdats.append(struct.pack(">I4s", length + header, b"mdat"))
+        mdats.extend(payload)
+        position += length + header
+    moov = _moov(tracks, chunks, [offsets[(c[0], c[1])] for c in chunks], co64, truncate)
+    if layout == "start":
+        pieces = [ftyp, moov, free_box] + mdats + [trailing]
+    else:
+        pieces = [ftyp, free_box] + mdats + [moov, trailing]
+    with open(path, "wb") as f:
+        for piece in pieces:
+            if isinstance(piece, int):
+                f.seek(piece, 1)
+            else:
+                f.write(piece)
+    return tracks
+
+
+def _map(path):
+    # 使用mmap，超过4GB的稀疏文件也不会整个读入内存
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def top_level(path):
+    """返回顶层box类型列表"""
+    data = _map(path)
+    types, offset = [], 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+        if size < 8 or offset + size > len(data):
+            break
+        types.append(box_type.decode("latin-1"))
+        offset += size
+    return types
+
+
+def _children(data, start, end):
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        yield box_type.decode("latin-1"), offset + header, offset + size
+        offset += size
+
+
+def _find(data, start, end, path):
+    for box_type, body, box_end in _children(data, start, end):
+        if box_type == path[0]:
+            return (body, box_end) if len(path) == 1 else _find(data, body, box_end, path[1:])
+    return None
+
+
+def read_samples(path):
+    """按文件中的采样表读出每个轨道的全部样本内容"""
+    data = _map(path)
+    moov = _find(data, 0, len(data), ["moov"])
+    tracks = []
+    for box_type, body, end in _children(data, *moov):
+        if box_type != "trak":
+            continue
+        stbl = _find(data, body, end, ["mdia", "minf", "stbl"])
+        tables = {t: (b, e) for t, b, e in _children(data, *stbl)}
+        stsz = tables["stsz"][0]
+        uniform, count = struct.unpack_from(">II", data, stsz + 4)
+        sizes = [uniform] * count if uniform else list(struct.unpack_from(">%dI" % count, data, stsz + 12))
+        stsc = tables["stsc"][0]
+        entries = [struct.unpack_from(">III", data, stsc + 8 + 12 * i)
+                   for i in range(struct.unpack_from(">I", data, stsc + 4)[0])]
+        if "co64" in tables:
+            start = tables["co64"][0]
+            n = struct.unpack_from(">I", data, start + 4)[0]
+            chunk_offsets = struct.unpack_from(">%dQ" % n, data, start + 8)
+        else:
+            start = tables["stco"][0]
+            n = struct.unpack_from(">I", data, start + 4)[0]
+            chunk_offsets = struct.unpack_from(">%dI" % n, data, start + 8)
+        samples = []
+        for chunk, offset in enumerate(chunk_offsets):
+            per_chunk = [e for e in entries if e[0] <= chunk + 1][-1][1]
+            for _ in range(per_chunk):
+                size = sizes[len(samples)]
+                samples.append(data[offset:offset + size])
+                offset += size
+        assert len(samples) == count
+        tracks.append(samples)
+    return tracks
+
+
+def chunk_box_types(path):
+    """返回每个轨道使用的块偏移表类型（stco或co64）"""
+    data = _map(path)
+    moov = _find(data, 0, len(data), ["moov"])
+    types = []
+    for box_type, body, end in _children(data, *moov):
+        if box_type == "trak":
+            stbl = _find(data, body, end, ["mdia", "minf", "stbl"])
+            types.append(next(t for t, _, _ in _children(data, *stbl) if t in ("stco", "co64")))
+    return types
+
+
+def expected_samples(tracks=None):
+    tracks = tracks or DEFAULT_TRACKS
+    return [[sample_bytes(i, k, t["size"]) for k in range(t["count"])] for i, t in enumerate(tracks)]
@@ -0,0 +1,68 @@
+import pytest
+
+import mp4_moov_fixer
+from mp4_moov_fixer import ConcurrencyController
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mp4_moov_fixer.time, "time", lambda: now[0])
+    return now
+
+
+def window(controller, clock, throughput_mb):
+    """按当前并发数完成一个1秒的统计窗口，吞吐量为 throughput_mb MB/s，返回窗口结束后的并发数"""
+    files = controller.limit
+    start = clock[0]
+    for i in range(1, files + 1):
+        assert controller.acquire()
+        clock[0] = start + 1.0 if i == files else start + i / files  # 窗口边界保持为整数秒，避免浮点误差
+        controller.release(int(throughput_mb * MB / files), 1.0)
+    return controller.limit
+
+
+def test_additive_increase_then_hold_at_knee(clock):
+    controller = ConcurrencyController(max_workers=8, adaptive=True, interval=1.0)
+    assert controller.limit == 1
+    assert window(controller, clock, 100) == 2  # 第一个窗口没有比较基准，直接加1
+    assert window(controller, clock, 150) == 3  # 增长超过10%，加性增大
+    assert window(controller, clock, 155) == 2  # 增长停滞，退回拐点
+    assert controller.holding
+    assert window(controller, clock, 150) == 2  # 保持
+    assert [entry[1] for entry in controller.metrics()["concurrency_history"]] == [1, 2, 3, 2]
+
+
+def test_multiplicative_decrease_on_slowdown(clock):
+    controller = ConcurrencyController(max_workers=8, adaptive=True, interval=1.0)
+    throughput = 100
+    while controller.limit < 6:
+        throughput *= 1.5
+        window(controller, clock, throughput)
+    assert window(controller, clock, throughput * 0.5) == 3  # 吞吐量下降超过20%，减半
+    assert not controller.holding
+    assert window(controller, clock, throughput * 0.2) == 1
+    assert window(controller, clock, throughput * 0.05) == 1  # 不低于1
+
+
+def test_limit_is_clamped_to_max_workers(clock):
+    controller = ConcurrencyController(max_workers=2, adaptive=True, interval=1.0)
+    for throughput in (100, 200, 400, 800):
+        window(controller, clock, throughput)
+    assert controller.limit == 2
+
+
+def test_short_windows_do_not_adjust(clock):
+    controller = ConcurrencyController(max_workers=8, adaptive=True, interval=5.0)
+    window(controller, clock, 100)
+    assert controller.limit == 1
+    assert not controller.history
+
+
+def test_fixed_mode_never_adjusts(clock):
+    controller = ConcurrencyController(max_workers=4, adaptive=False, interval=1.0)
+    for throughput in (100, 10, 1000):
+        assert window(controller, clock, throughput) == 4
+    assert controller.metrics()["concurrency"] == 4
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from mp4_factory import make_mp4
+from mp4_moov_fixer import BulkCopier, MP4MoovFixer
+
+# 大小不按页对齐，分段复制时最后一段也不对齐
+SIZE = 3 * 1024 * 1024 + 1234
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "src.bin"
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+@pytest.mark.parametrize("options", [
+    dict(),
+    dict(direct_io=True),
+    dict(threads=4, extent_size=256 * 1024),
+    dict(direct_io=True, threads=4, extent_size=256 * 1024),
+    dict(chunk_size=100 * 1024, sync_interval=300 * 1024),
+], ids=["fadvise", "direct", "threads", "direct-threads", "small-chunks"])
+def test_copy_is_byte_identical(tmp_path, source, options):
+    copier = BulkCopier(**options)
+    assert copier.copy_file(str(source), str(tmp_path / "dst.bin")) == SIZE
+    assert (tmp_path / "dst.bin").read_bytes() == source.read_bytes()
+    assert os.stat(tmp_path / "dst.bin").st_mtime == os.stat(source).st_mtime
+
+
+def test_copy_extents_moves_ranges(tmp_path, source):
+    data = source.read_bytes()
+    copier = BulkCopier(threads=3, extent_size=64 * 1024)
+    src_fd = os.open(source, os.O_RDONLY)
+    dst_fd = os.open(tmp_path / "dst.bin", os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        ranges = [(1000, 0, 500 * 1024 + 7), (0, 500 * 1024 + 7, 1000), (SIZE - 99, 600 * 1024, 99)]
+        assert copier.copy_extents(src_fd, dst_fd, ranges) == sum(n for _, _, n in ranges)
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    copied = (tmp_path / "dst.bin").read_bytes()
+    for src_offset, dst_offset, length in ranges:
+        assert copied[dst_offset:dst_offset + length] == data[src_offset:src_offset + length]
+
+
+def test_failed_copy_removes_partial_output(tmp_path, monkeypatch):
+    make_mp4(tmp_path / "a.mp4", layout="start")
+
+    def fail(self, src, dst):
+        with open(dst, "wb") as f:
+            f.write(b"partial")
+        raise OSError("设备已断开")
+
+    monkeypatch.setattr(BulkCopier, "copy_file", fail)
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used")
+    result = fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4"))
+    assert result.action == "failed"
+    assert result.error == "设备已断开"
+    assert not (tmp_path / "b.mp4").exists()
+
+
+def test_punched_hole_stays_sparse(tmp_path):
+    path = tmp_path / "sparse.bin"
+    hole = 16 * 1024 * 1024
+    head, tail = os.urandom(1024 * 1024 + 5), os.urandom(777)
+    with open(path, "wb") as f:
+        f.write(head)
+        f.seek(hole, os.SEEK_CUR)
+        f.write(tail)
+        f.seek(hole, os.SEEK_CUR)
+        f.truncate()  # 末尾同样是空洞
+    size = os.path.getsize(path)
+    if os.stat(path).st_blocks * 512 >= size or not hasattr(os, "SEEK_HOLE"):
+        pytest.skip("临时目录所在的文件系统不支持稀疏文件")
+
+    copier = BulkCopier(threads=2, extent_size=512 * 1024)
+    copier.copy_file(str(path), str(tmp_path / "dst.bin"))
+    dst = tmp_path / "dst.bin"
+    assert dst.read_bytes() == path.read_bytes()
+    assert copier.sparse_bytes >= hole
+    assert os.stat(dst).st_blocks * 512 < size - hole
+    fd = os.open(dst, os.O_RDONLY)
+    try:
+        assert os.lseek(fd, 0, os.SEEK_HOLE) < len(head) + hole
+    finally:
+        os.close(fd)
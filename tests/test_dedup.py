@@ -0,0 +1,95 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from mp4_factory import make_mp4
+from mp4_moov_fixer import DedupIndex, MP4MoovFixer, clone_file
+
+
+def _record_many(path, output, worker, count):
+    index = DedupIndex(path)
+    for i in range(count):
+        index.record(f"{worker}:{i}", output)
+
+
+def _reflink_supported(tmp_path):
+    (tmp_path / "probe").write_bytes(b"x")
+    try:
+        clone_file(str(tmp_path / "probe"), str(tmp_path / "probe.clone"))
+        return True
+    except OSError:
+        return False
+
+
+def test_records_are_appended_and_shared(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    output = tmp_path / "out.mp4"
+    output.write_bytes(b"data")
+    first, second = DedupIndex(path), DedupIndex(path)
+    first.record("a", str(output))
+    second.record("b", str(output))
+    # 其他实例追加的记录在查询未命中时读入
+    assert first.lookup("b") == str(output)
+    assert len(open(path).readlines()) == 2
+
+
+def test_load_compacts_duplicate_and_corrupt_lines(tmp_path):
+    path = tmp_path / "index.jsonl"
+    output = tmp_path / "out.mp4"
+    output.write_bytes(b"data")
+    index = DedupIndex(str(path))
+    index.record("a", str(output))
+    index.record("a", str(output))
+    index.record("b", str(output))
+    with open(path, "a") as f:
+        f.write("not json\n")
+        f.write(json.dumps({"output": str(output), "size": 4}) + "\n")  # 没有指纹的记录
+    reloaded = DedupIndex(str(path))
+    assert reloaded.lookup("a") == reloaded.lookup("b") == str(output)
+    assert sorted(json.loads(line)["fingerprint"] for line in path.read_text().splitlines()) == ["a", "b"]
+
+
+def test_truncated_index_is_read_from_start(tmp_path):
+    path = tmp_path / "index.jsonl"
+    output = tmp_path / "out.mp4"
+    output.write_bytes(b"data")
+    index = DedupIndex(str(path))
+    for name in ("a", "b", "c"):
+        index.record(name, str(output))
+    # 同一inode上被清空后由其他进程写入较短的内容
+    path.write_text(json.dumps({"fingerprint": "d", "output": str(output), "size": 4}) + "\n")
+    assert index.lookup("d") == str(output)
+    assert index.lookup("a") is None
+    assert list(index.entries) == ["d"]
+
+
+def test_concurrent_processes_keep_all_records(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    output = tmp_path / "out.mp4"
+    output.write_bytes(b"data")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_record_many, args=(path, str(output), w, 50)) for w in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert len(DedupIndex(path).entries) == 200
+
+
+@pytest.mark.parametrize("hardlink", [False, True])
+def test_duplicates_are_not_hardlinked_by_default(tmp_path, hardlink):
+    if _reflink_supported(tmp_path):
+        pytest.skip("文件系统支持reflink，不会使用硬链接或复制")
+    make_mp4(tmp_path / "a.mp4", layout="start")
+    make_mp4(tmp_path / "b.mp4", layout="start")
+    (tmp_path / "out").mkdir()
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), output_dir="out", verbose=False, ffmpeg_path="ffmpeg-not-used",
+                         dedup_index=str(tmp_path / "index.jsonl"), dedup_hardlink=hardlink)
+    assert fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "a.mp4")).action == "copied"
+    result = fixer.fix_file(str(tmp_path / "b.mp4"), str(tmp_path / "out" / "b.mp4"))
+    assert result.action == "duplicate"
+    assert (tmp_path / "out" / "b.mp4").read_bytes() == (tmp_path / "a.mp4").read_bytes()
+    assert os.stat(tmp_path / "out" / "b.mp4").st_nlink == (2 if hardlink else 1)
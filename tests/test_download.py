@@ -0,0 +1,126 @@
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+
+from mp4_moov_fixer import MP4MoovFixer, SegmentedDownloader
+
+PAYLOAD = os.urandom(600 * 1024)
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """支持Range的静态文件服务；server.truncate_next 个请求只发送一半数据就断开连接"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = 0, len(PAYLOAD) - 1
+        requested = self.headers.get("Range")
+        self.server.requests.append(requested)
+        if requested:
+            first, last = requested.split("=")[1].split("-")
+            start, end = int(first), int(last) if last else len(PAYLOAD) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        body = PAYLOAD[start:end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.truncate_next:
+            self.server.truncate_next -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.requests = []
+    httpd.truncate_next = 0
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/ffmpeg"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    # 让小文件也被分成多个分段，并缩短重试等待
+    monkeypatch.setattr(SegmentedDownloader, "MIN_SEGMENT", 128 * 1024)
+    monkeypatch.setattr("mp4_moov_fixer.time.sleep", lambda seconds: None)
+
+
+def test_parallel_segments_and_checksum(server, tmp_path):
+    dest = tmp_path / "ffmpeg"
+    digest = SegmentedDownloader(server.url, str(dest), connections=4, expected_sha256=PAYLOAD_SHA256).run()
+    assert digest == PAYLOAD_SHA256
+    assert dest.read_bytes() == PAYLOAD
+    assert len(server.requests) == 4
+    assert not list(tmp_path.glob("ffmpeg.part*"))
+
+
+def test_resume_existing_part(server, tmp_path):
+    dest = tmp_path / "ffmpeg"
+    (tmp_path / "ffmpeg.part0").write_bytes(PAYLOAD[:1000])
+    SegmentedDownloader(server.url, str(dest), connections=1, expected_sha256=PAYLOAD_SHA256).run()
+    assert server.requests == [f"bytes=1000-{len(PAYLOAD) - 1}"]
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_interrupted_download_resumes(server, tmp_path):
+    server.truncate_next = 1
+    dest = tmp_path / "ffmpeg"
+    SegmentedDownloader(server.url, str(dest), connections=1, expected_sha256=PAYLOAD_SHA256).run()
+    assert dest.read_bytes() == PAYLOAD
+    assert len(server.requests) == 2
+    first, second = server.requests
+    assert first == f"bytes=0-{len(PAYLOAD) - 1}"
+    assert int(second.split("=")[1].split("-")[0]) > 0  # 第二次请求从已下载的位置继续
+
+
+def test_bad_checksum_is_rejected(server, tmp_path):
+    dest = tmp_path / "ffmpeg"
+    with pytest.raises(IOError, match="SHA-256"):
+        SegmentedDownloader(server.url, str(dest), expected_sha256="0" * 64).run()
+    assert not dest.exists()
+    assert not [p for p in tmp_path.iterdir()]
+
+
+def test_shared_cache_is_reused(server, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("MP4_MOOV_FIXER_CACHE", str(cache_dir))
+    monkeypatch.chdir(tmp_path)
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="unused",
+                         progress_callback=lambda *args: None)
+    assert fixer._download_ffmpeg(url=server.url, expected_sha256=PAYLOAD_SHA256)
+    assert open(fixer.ffmpeg_path, "rb").read() == PAYLOAD
+    requests_after_first = len(server.requests)
+
+    # 第二个进程（或用户）直接使用共享缓存，不再下载
+    other = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="unused",
+                         progress_callback=lambda *args: None)
+    assert other._download_ffmpeg(url=server.url, expected_sha256=PAYLOAD_SHA256)
+    assert len(server.requests) == requests_after_first
+
+    # 缓存内容与校验值不一致时重新下载
+    (cache_dir / "ffmpeg").write_bytes(b"corrupted")
+    assert other._download_ffmpeg(url=server.url, expected_sha256=PAYLOAD_SHA256)
+    assert len(server.requests) > requests_after_first
+    assert (cache_dir / "ffmpeg").read_bytes() == PAYLOAD
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from mp4_factory import make_mp4
+from mp4_moov_fixer import OUTSIDE_OUTPUT, MP4MoovFixer, main, make_output_mapper, run_files_from
+
+NAMES = [f"clip{i}.mp4" for i in range(8)]
+
+
+def test_output_mapper_stays_in_output_dir(tmp_path):
+    out = tmp_path / "out"
+    src = str(tmp_path / "in" / "sub" / "a.mp4")
+    assert make_output_mapper(str(out), "mirror", str(tmp_path / "in"))(src) == str(out / "sub" / "a.mp4")
+    assert make_output_mapper(str(out), "flat", str(tmp_path))(src) == str(out / "a.mp4")
+    template = make_output_mapper(str(out), "{dir}/../{stem}_fixed{ext}", str(tmp_path / "in"))
+    assert template(src) == str(out / "a_fixed.mp4")
+    for mapping in ("../{name}", "{dir}/../../{name}", str(tmp_path / "{name}")):
+        with pytest.raises(ValueError, match=OUTSIDE_OUTPUT):
+            make_output_mapper(str(out), mapping, str(tmp_path / "in"))(src)
+
+
+def test_escaping_output_fails_only_that_path(tmp_path, capsys):
+    (tmp_path / "sub").mkdir()
+    make_mp4(tmp_path / "sub" / "a.mp4")
+    make_mp4(tmp_path / "b.mp4")
+    (tmp_path / "list.txt").write_text("sub/a.mp4\nb.mp4\n")
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), output_dir="out", verbose=False, ffmpeg_path="ffmpeg-not-used")
+    # 输入目录下的b.mp4没有{dir}，模板得到 "/../b.mp4"，在输出目录之外
+    assert not run_files_from(fixer, str(tmp_path / "list.txt"), "{dir}/../{name}")
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(line["action"], line["error"]) for line in lines] == [("fixed", None), ("failed", OUTSIDE_OUTPUT)]
+    assert (tmp_path / "out" / "a.mp4").exists()
+
+
+def test_shard_matches_directory_mode(tmp_path, capsys):
+    for name in NAMES:
+        make_mp4(tmp_path / name, layout="start")
+    (tmp_path / "list.txt").write_text("".join(f"{path}\n" for path in
+                                               [str(tmp_path / n) for n in NAMES[:4]] + [f"./{n}" for n in NAMES[4:]]))
+    for k in (1, 2):
+        directory = MP4MoovFixer(input_dir=str(tmp_path), output_dir=f"dir{k}", verbose=False,
+                                 ffmpeg_path="ffmpeg-not-used", shard=(k, 2))
+        assert directory.process_files()
+        streamed = MP4MoovFixer(input_dir=str(tmp_path), output_dir=f"stream{k}", verbose=False,
+                                ffmpeg_path="ffmpeg-not-used", shard=(k, 2))
+        assert run_files_from(streamed, str(tmp_path / "list.txt"), "flat")
+        capsys.readouterr()
+        assert sorted(os.listdir(tmp_path / f"dir{k}")) == sorted(os.listdir(tmp_path / f"stream{k}"))
+
+
+@pytest.mark.parametrize("mapping, message", [
+    ("{foo}/{name}", "{foo}"), ("{0}", "位置字段"), ("{name", "无效的输出映射模板"), ("{name.x}", "无效的输出映射模板"),
+    ("copy", "未知的输出映射"),
+])
+def test_invalid_mapping_is_rejected_up_front(tmp_path, mapping, message):
+    with pytest.raises(ValueError, match=message):
+        make_output_mapper(str(tmp_path / "out"), mapping, str(tmp_path))
+    (tmp_path / "list.txt").write_text("a.mp4\n")
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), output_dir="out", verbose=False, ffmpeg_path="ffmpeg-not-used")
+    with pytest.raises(ValueError, match=message):
+        run_files_from(fixer, str(tmp_path / "list.txt"), mapping)
+
+
+def test_cli_reports_invalid_template(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr("sys.argv", ["mp4_moov_fixer.py", "--input", str(tmp_path),
+                                     "--files-from", "-", "--output-map", "{foo}"])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 2
+    assert "未知字段 {foo}" in capsys.readouterr().err
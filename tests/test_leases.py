@@ -0,0 +1,60 @@
+import os
+import time
+
+from mp4_moov_fixer import LeaseManager
+
+
+def expire(manager, rel_path):
+    """停止manager的心跳并把它的锁改为早已过期"""
+    manager.stop_event.set()
+    lock_path = manager._lock_path(manager._key(rel_path))
+    old = time.time() - 3600
+    os.utime(lock_path, (old, old))
+    return lock_path
+
+
+def test_takeover_and_late_release(tmp_path):
+    a, b, c = (LeaseManager(str(tmp_path), node, lease_ttl=60) for node in ("a", "b", "c"))
+    assert a.try_acquire("x.mp4")
+    assert not b.try_acquire("x.mp4")
+    lock_path = expire(a, "x.mp4")
+    assert b.try_acquire("x.mp4")
+
+    # a的租约已丢失：不能删除b的锁，也不能写完成标记
+    assert not a.release("x.mp4", done=True)
+    assert os.path.exists(lock_path)
+    assert not a.is_done("x.mp4")
+    assert not c.try_acquire("x.mp4")
+
+    assert b.release("x.mp4", done=True)
+    assert not os.path.exists(lock_path)
+    assert b.is_done("x.mp4")
+    assert not c.try_acquire("x.mp4")
+    for manager in (a, b, c):
+        manager.close()
+
+
+def test_heartbeat_does_not_refresh_a_lost_lease(tmp_path):
+    a, b = LeaseManager(str(tmp_path), "a", lease_ttl=60), LeaseManager(str(tmp_path), "b", lease_ttl=60)
+    assert a.try_acquire("x.mp4")
+    lock_path = expire(a, "x.mp4")
+    assert b.try_acquire("x.mp4")
+    b.stop_event.set()
+    old = time.time() - 30
+    os.utime(lock_path, (old, old))
+    a._heartbeat()
+    assert os.stat(lock_path).st_mtime == old
+    assert not a.held
+    a.close()
+    assert os.path.exists(lock_path)
+    b.close()
+    assert not os.path.exists(lock_path)
+
+
+def test_release_frees_the_file_for_other_nodes(tmp_path):
+    a, b = LeaseManager(str(tmp_path), "a"), LeaseManager(str(tmp_path), "b")
+    assert a.try_acquire("x.mp4")
+    assert a.release("x.mp4")
+    assert b.try_acquire("x.mp4")
+    a.close()
+    b.close()
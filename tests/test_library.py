@@ -0,0 +1,71 @@
+import sys
+
+import pytest
+
+import mp4_moov_fixer
+from mp4_factory import expected_samples, make_mp4, read_samples
+from mp4_moov_fixer import MP4MoovFixer, fix_file, iter_process
+
+
+@pytest.fixture
+def no_ffmpeg(tmp_path, monkeypatch):
+    """模拟没有安装FFmpeg的Linux环境，记录目录遍历次数"""
+    walks = []
+    real_walk = mp4_moov_fixer.os.walk
+    monkeypatch.setattr(mp4_moov_fixer, "_ffmpeg_paths", {})
+    monkeypatch.setattr(mp4_moov_fixer.shutil, "which", lambda cmd: None)
+    monkeypatch.setattr(mp4_moov_fixer.os, "walk", lambda top: walks.append(top) or real_walk(top))
+    monkeypatch.setattr(sys, "platform", "linux")
+    monkeypatch.delenv("MP4_MOOV_FIXER_FFMPEG_URL", raising=False)
+    monkeypatch.chdir(tmp_path)
+    return walks
+
+
+def test_fix_file_without_ffmpeg_uses_native(no_ffmpeg, tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    result = fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "a.mp4"))
+    assert result.action == "fixed"
+    assert read_samples(tmp_path / "out" / "a.mp4") == expected_samples()
+
+
+def test_unsupported_file_without_ffmpeg_fails_cleanly(no_ffmpeg, tmp_path):
+    # 文件末尾无法解析的数据使原生方式放弃，需要FFmpeg但无法获取
+    make_mp4(tmp_path / "a.mp4", trailing=b"\x00\x00\x00\x02junk")
+    result = fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "a.mp4"))
+    assert not result.ok
+    assert not (tmp_path / "out" / "a.mp4").exists()
+
+
+def test_ffmpeg_engine_without_ffmpeg_returns_error(no_ffmpeg, tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    result = fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "a.mp4"), engine="ffmpeg")
+    assert result.error == "无法获取FFmpeg"
+
+
+def test_ffmpeg_lookup_is_cached(no_ffmpeg, tmp_path):
+    for name in ("a.mp4", "b.mp4", "c.mp4"):
+        make_mp4(tmp_path / name)
+        assert fix_file(str(tmp_path / name), str(tmp_path / "out" / name)).ok
+    assert no_ffmpeg == [str(tmp_path)]
+
+
+def test_input_errors_are_raised_to_the_caller(no_ffmpeg, tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+
+    def paths():
+        yield "a.mp4"
+        raise OSError("input stream broken")
+
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), output_dir="out", verbose=False, workers=2)
+    results = []
+    with pytest.raises(OSError, match="input stream broken"):
+        for result in fixer.iter_process(paths()):
+            results.append(result)
+    assert [r.action for r in results] == ["fixed"]
+
+
+def test_iter_process_without_ffmpeg(no_ffmpeg, tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    make_mp4(tmp_path / "b.mp4", layout="start")
+    results = list(iter_process(["a.mp4", "b.mp4"], input_dir=str(tmp_path), ordered=True))
+    assert [r.action for r in results] == ["fixed", "copied"]
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from mp4_factory import box, chunk_box_types, expected_samples, make_mp4, read_samples, top_level
+from mp4_moov_fixer import MP4MoovFixer, NativeRelocator, NativeUnsupported
+
+FRAGMENTED = box("moof", b"\0" * 16) + box("mdat", b"")
+
+
+@pytest.mark.parametrize("options", [
+    dict(),
+    dict(co64=True),
+    dict(free=100),
+    dict(interleave=True),
+    dict(mdat_count=2),
+    dict(mdat_count=4, free=20),
+])
+def test_relocation_keeps_samples(tmp_path, options):
+    make_mp4(tmp_path / "a.mp4", **options)
+    size = os.path.getsize(tmp_path / "a.mp4")
+    written = NativeRelocator(str(tmp_path / "a.mp4")).write(str(tmp_path / "b.mp4"))
+    assert written == size == os.path.getsize(tmp_path / "b.mp4")
+    types = top_level(tmp_path / "b.mp4")
+    assert types.index("moov") < types.index("mdat")
+    assert types.count("mdat") == options.get("mdat_count", 1)
+    assert chunk_box_types(tmp_path / "b.mp4") == ["co64" if options.get("co64") else "stco"] * 2
+    assert read_samples(tmp_path / "b.mp4") == expected_samples()
+
+
+def test_stco_is_promoted_past_4gb(tmp_path):
+    # 音频的最后一块紧挨在4GB以内，moov移到开头后超过32位偏移的范围
+    path = tmp_path / "a.mp4"
+    data_before_gap = 24 + 16 + 60 * 3000 + 50 * 400
+    make_mp4(path, gap=2 ** 32 - 500 - data_before_gap)
+    if os.stat(path).st_blocks * 512 >= os.path.getsize(path):
+        pytest.skip("临时目录所在的文件系统不支持稀疏文件")
+    assert chunk_box_types(path) == ["stco", "stco"]
+    NativeRelocator(str(path)).write(str(tmp_path / "b.mp4"))
+    assert chunk_box_types(tmp_path / "b.mp4") == ["stco", "co64"]
+    assert read_samples(tmp_path / "b.mp4") == expected_samples()
+
+
+@pytest.mark.parametrize("trailing", [FRAGMENTED, b"\0\0\0\x02junk"])
+def test_unsupported_layouts_are_rejected(tmp_path, trailing):
+    make_mp4(tmp_path / "a.mp4", trailing=trailing)
+    with pytest.raises(NativeUnsupported):
+        NativeRelocator(str(tmp_path / "a.mp4"))
+
+
+@pytest.mark.parametrize("trailing", [FRAGMENTED, b"\0\0\0\x02junk"])
+def test_auto_engine_falls_back_to_ffmpeg(tmp_path, monkeypatch, trailing):
+    make_mp4(tmp_path / "a.mp4", trailing=trailing)
+    calls = []
+
+    def fake_ffmpeg(self, input_file, output_file):
+        calls.append(input_file)
+        with open(input_file, "rb") as src, open(output_file, "wb") as dst:
+            dst.write(src.read())
+        return True
+
+    monkeypatch.setattr(MP4MoovFixer, "_fix_moov_ffmpeg", fake_ffmpeg)
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used")
+    result = fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4"))
+    assert result.action == "fixed"
+    assert calls == [str(tmp_path / "a.mp4")]
+
+    calls.clear()
+    native = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used", engine="native")
+    result = native.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "c.mp4"))
+    assert not result.ok
+    assert not calls
+    assert not (tmp_path / "c.mp4").exists()
+
+
+def test_fix_file_relocates_natively(tmp_path, monkeypatch):
+    make_mp4(tmp_path / "a.mp4", mdat_count=2)
+    monkeypatch.setattr(MP4MoovFixer, "_fix_moov_ffmpeg", lambda *args: pytest.fail("不应调用FFmpeg"))
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used")
+    result = fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4"))
+    assert (result.layout, result.action) == ("moov-at-end", "fixed")
+    assert read_samples(tmp_path / "b.mp4") == expected_samples()
@@ -0,0 +1,96 @@
+import os
+import struct
+
+import pytest
+
+from mp4_factory import expected_samples, make_mp4, read_samples, top_level
+from mp4_moov_fixer import MdatRewriter, MP4MoovFixer, NativeUnsupported
+
+
+def corrupt(path, box_type, field_offset, value):
+    """把第一个box_type的内容中field_offset处的32位字段改为value"""
+    data = bytearray(path.read_bytes())
+    struct.pack_into(">I", data, data.index(box_type.encode()) + 4 + field_offset, value)
+    path.write_bytes(bytes(data))
+
+
+@pytest.mark.parametrize("box_type, field_offset", [("stsz", 8), ("stsc", 4), ("stts", 4), ("stco", 4)])
+def test_malformed_tables_fall_back(tmp_path, box_type, field_offset):
+    path = tmp_path / "a.mp4"
+    make_mp4(path)
+    corrupt(path, box_type, field_offset, 0x00FFFFFF)
+    with pytest.raises(NativeUnsupported):
+        MdatRewriter(str(path), compact=True)
+
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used",
+                         engine="native", compact=True)
+    result = fixer.fix_file(str(path), str(tmp_path / "b.mp4"))
+    # 无法重建mdat时按普通流程处理：stco完好时仍可直接移动moov
+    if box_type == "stco":
+        assert not result.ok
+    else:
+        assert result.action == "fixed"
+        assert os.path.getsize(tmp_path / "b.mp4") == os.path.getsize(path)
+
+
+@pytest.mark.parametrize("truncate", [dict(stsz=8), dict(stsz=4 * 60), dict(stsc=4), dict(stsc=12)])
+@pytest.mark.parametrize("options", [dict(compact=True), dict(interleave=0.5)])
+def test_truncated_tables_are_unsupported_and_fall_back(tmp_path, truncate, options):
+    path = tmp_path / "a.mp4"
+    make_mp4(path, truncate=truncate)
+    with pytest.raises(NativeUnsupported):
+        MdatRewriter(str(path), compact=True)
+
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used", **options)
+    result = fixer.fix_file(str(path), str(tmp_path / "b.mp4"))
+    # 无法重建mdat，记录原因后只移动moov，块偏移表完好，无需FFmpeg
+    assert any("无法按采样表重建" in entry for entry in fixer.log_entries)
+    assert result.action == "fixed"
+    assert result.bytes_saved == 0 and result.interleave is None
+    assert os.path.getsize(tmp_path / "b.mp4") == os.path.getsize(path)
+    assert top_level(tmp_path / "b.mp4") == ["ftyp", "moov", "mdat"]
+
+
+def test_compact_keeps_samples(tmp_path):
+    make_mp4(tmp_path / "a.mp4", free=500, orphan=300)
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used", compact=True)
+    result = fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4"))
+    assert result.action == "fixed"
+    assert result.bytes_saved == 508 + 300
+    assert read_samples(tmp_path / "b.mp4") == expected_samples()
+
+
+@pytest.mark.parametrize("options", [dict(compact=True), dict(interleave=0.5), dict(interleave=0.5, compact=True)])
+@pytest.mark.parametrize("layout", [dict(), dict(reverse_track=0), dict(interleave=True, mdat_count=2, free=64)])
+def test_rewrite_keeps_samples(tmp_path, options, layout):
+    make_mp4(tmp_path / "a.mp4", **layout)
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used", engine="native",
+                         **options)
+    result = fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4"))
+    assert result.action == "fixed"
+    types = top_level(tmp_path / "b.mp4")
+    assert types.index("moov") < types.index("mdat")
+    assert read_samples(tmp_path / "b.mp4") == expected_samples()
+
+
+def test_padding_is_not_counted_against_savings(tmp_path):
+    make_mp4(tmp_path / "a.mp4", free=16)
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used", compact=True,
+                         moov_padding=64 * 1024)
+    result = fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4"))
+    assert result.bytes_saved == 24
+    assert os.path.getsize(tmp_path / "b.mp4") == result.bytes_read - 24 + 64 * 1024
+    assert top_level(tmp_path / "b.mp4")[:3] == ["ftyp", "moov", "free"]
+    assert read_samples(tmp_path / "b.mp4") == expected_samples()
+
+
+def test_sparse_source_is_not_preallocated(tmp_path, monkeypatch):
+    path = tmp_path / "a.mp4"
+    make_mp4(path, gap=64 * 1024 * 1024)
+    if os.stat(path).st_blocks * 512 >= os.path.getsize(path):
+        pytest.skip("临时目录所在的文件系统不支持稀疏文件")
+    calls = []
+    monkeypatch.setattr("mp4_moov_fixer.preallocate", lambda fd, size: calls.append(size))
+    MdatRewriter(str(path)).write(str(tmp_path / "b.mp4"))
+    assert not calls
+    assert read_samples(tmp_path / "b.mp4") == expected_samples()
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import pytest
+
+from mp4_moov_fixer import SCHEDULE_POLICIES, order_files
+
+# 目录扫描顺序为 d、a、c、b、e；a与c大小相同，c与e修改时间相同
+NAMES = ["d.mp4", "a.mp4", "c.mp4", "b.mp4", "e.mp4"]
+STATS = {
+    "d.mp4": SimpleNamespace(st_size=400, st_mtime=50),
+    "a.mp4": SimpleNamespace(st_size=200, st_mtime=10),
+    "c.mp4": SimpleNamespace(st_size=200, st_mtime=30),
+    "b.mp4": SimpleNamespace(st_size=900, st_mtime=20),
+    "e.mp4": SimpleNamespace(st_size=100, st_mtime=30),
+}
+
+
+@pytest.mark.parametrize("policy, expected", [
+    ("listdir", ["d.mp4", "a.mp4", "c.mp4", "b.mp4", "e.mp4"]),
+    ("largest", ["b.mp4", "d.mp4", "a.mp4", "c.mp4", "e.mp4"]),
+    ("smallest", ["e.mp4", "a.mp4", "c.mp4", "d.mp4", "b.mp4"]),
+    ("mtime", ["a.mp4", "b.mp4", "c.mp4", "e.mp4", "d.mp4"]),
+])
+def test_policy_order(policy, expected):
+    # 相同大小或修改时间的文件保持目录扫描顺序
+    assert order_files(NAMES, STATS, policy) == expected
+
+
+def test_all_policies_are_covered():
+    assert set(SCHEDULE_POLICIES) == {"listdir", "largest", "smallest", "mtime"}
+
+
+def test_input_is_not_modified_and_unknown_policy_is_rejected():
+    names = list(NAMES)
+    order_files(names, STATS, "largest")
+    assert names == NAMES
+    with pytest.raises(ValueError):
+        order_files(names, STATS, "random")
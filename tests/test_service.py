@@ -0,0 +1,113 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from mp4_factory import expected_samples, make_mp4, read_samples
+from mp4_moov_fixer import FixJob, FixJobClient, FixJobHTTPServer, FixJobService
+
+
+@pytest.fixture
+def serve():
+    """启动进程内的HTTP服务，返回 (service, client)；start=False时不启动工作线程，任务一直排队"""
+    servers = []
+
+    def start(start=True, **opts):
+        # 合成文件由原生方式处理，不会调用FFmpeg
+        service = FixJobService(ffmpeg_path="ffmpeg-not-used", **opts)
+        if start:
+            assert service.start()
+        server = FixJobHTTPServer(("127.0.0.1", 0), service)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append((server, service))
+        return service, FixJobClient(port=server.server_address[1], timeout=10)
+
+    yield start
+    for server, service in servers:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+
+def test_submit_and_wait(serve, tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    _, client = serve()
+    code, job = client.submit(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "a.mp4"))
+    assert code == 202
+    final = client.wait(job["id"])
+    assert final["state"] == "fixed"
+    assert final["result"]["layout"] == "moov-at-end"
+    assert read_samples(tmp_path / "out" / "a.mp4") == expected_samples()
+
+
+def test_events_stream_ndjson(serve, tmp_path):
+    make_mp4(tmp_path / "a.mp4", layout="start")
+    _, client = serve()
+    _, job = client.submit(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "a.mp4"))
+    states = [event["state"] for event in client.events(job["id"]) if event["type"] == "state"]
+    assert states == ["queued", "running", "copied"]
+
+
+def test_missing_input_is_rejected(serve, tmp_path):
+    _, client = serve()
+    code, body = client.submit(str(tmp_path / "missing.mp4"))
+    assert code == 400
+    assert "error" in body
+
+
+def test_cancel_frees_queue_slot(serve, tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    service, client = serve(start=False, queue_size=1)
+    _, job = client.submit(str(tmp_path / "a.mp4"))
+    assert client.submit(str(tmp_path / "a.mp4"))[0] == 503
+    assert client.cancel(job["id"])["state"] == "cancelled"
+    assert service.queue.qsize() == 0
+    assert client.submit(str(tmp_path / "a.mp4"))[0] == 202
+    # 已取消的任务不能再次取消
+    assert "error" in client.cancel(job["id"])
+
+
+def test_finished_jobs_are_evicted(serve, tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    _, client = serve(max_finished=1)
+    _, first = client.submit(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "1.mp4"))
+    client.wait(first["id"])
+    _, second = client.submit(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "2.mp4"))
+    client.wait(second["id"])
+    _, third = client.submit(str(tmp_path / "a.mp4"), str(tmp_path / "out" / "3.mp4"))
+    client.wait(third["id"])
+    assert client.status(first["id"]) == {"error": "job not found"}
+    assert client.status(third["id"])["state"] == "fixed"
+
+
+def test_duplicate_job_reports_full_progress(tmp_path):
+    job = FixJob("j", str(tmp_path / "a.mp4"), str(tmp_path / "out.mp4"))
+    job.set_state("duplicate")
+    assert job.progress() == 100.0
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="需要Unix套接字")
+def test_unix_server_only_replaces_stale_sockets(tmp_path):
+    from mp4_moov_fixer import FixJobUnixServer
+    service = FixJobService(ffmpeg_path="ffmpeg-not-used")
+    path = str(tmp_path / "fixer.sock")
+
+    # 误写为普通文件的路径不会被删除
+    (tmp_path / "fixer.sock").write_text("keep me")
+    with pytest.raises(OSError, match="不是套接字"):
+        FixJobUnixServer(path, service)
+    assert (tmp_path / "fixer.sock").read_text() == "keep me"
+    os.remove(path)
+
+    # 遗留的套接字（无人监听）被替换
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = FixJobUnixServer(path, service)
+    try:
+        # 正在监听的套接字不会被抢占
+        with pytest.raises(OSError, match="已有服务在监听"):
+            FixJobUnixServer(path, service)
+    finally:
+        server.server_close()
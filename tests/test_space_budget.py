@@ -0,0 +1,23 @@
+from mp4_factory import make_mp4
+from mp4_moov_fixer import NO_SPACE, MP4MoovFixer, parse_size
+
+HUGE_RESERVE = parse_size("1000000T")
+
+
+def test_streaming_paths_use_space_admission(tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), output_dir="out", verbose=False, engine="native",
+                         space_reserve=HUGE_RESERVE)
+    results = list(fixer.iter_process(["a.mp4"]))
+    assert [r.error for r in results] == [NO_SPACE]
+    assert not (tmp_path / "out" / "a.mp4").exists()
+
+
+def test_explicit_order_is_kept_when_space_is_short(tmp_path):
+    make_mp4(tmp_path / "a.mp4")
+    messages = []
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), output_dir="out", verbose=False, order="largest", engine="native",
+                         space_reserve=HUGE_RESERVE, log_callback=messages.append)
+    fixer.process_files()
+    assert any("保持调度策略 largest" in m for m in messages)
+    assert fixer.run_metrics["skipped_no_space"] == 1
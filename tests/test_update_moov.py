@@ -0,0 +1,72 @@
+import os
+
+from mp4_factory import expected_samples, make_mp4, read_samples, top_level
+from mp4_moov_fixer import (DedupIndex, MP4Box, MP4MoovFixer, content_fingerprint, scan_top_level_boxes,
+                            update_moov)
+
+
+def fixed_file(tmp_path, padding):
+    make_mp4(tmp_path / "a.mp4")
+    fixer = MP4MoovFixer(input_dir=str(tmp_path), verbose=False, ffmpeg_path="ffmpeg-not-used",
+                         moov_padding=padding)
+    assert fixer.fix_file(str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4")).action == "fixed"
+    return tmp_path / "b.mp4"
+
+
+def tags(path):
+    """返回moov下所有udta的内容"""
+    _, offset, size = next(box for box in scan_top_level_boxes(str(path)) if box[0] == "moov")
+    with open(path, "rb") as f:
+        f.seek(offset)
+        moov = MP4Box.parse(f.read(size))[0]
+    return [child.payload for child in moov.children if child.type == "udta"]
+
+
+def add_tag(size):
+    calls = []
+
+    def edit(moov):
+        # 每次调用都追加一个udta，调用两次会留下两个
+        calls.append(1)
+        moov.children.append(MP4Box("udta", payload=b"t" * size))
+    edit.calls = calls
+    return edit
+
+
+def test_small_edit_is_in_place(tmp_path):
+    path = fixed_file(tmp_path, 4096)
+    size = os.path.getsize(path)
+    edit = add_tag(100)
+    assert update_moov(str(path), edit) == "in-place"
+    assert os.path.getsize(path) == size
+    assert tags(path) == [b"t" * 100]
+    assert read_samples(path) == expected_samples()
+
+
+def test_rewrite_applies_edit_once(tmp_path):
+    path = fixed_file(tmp_path, 0)
+    edit = add_tag(100)
+    assert update_moov(str(path), edit, padding=1024) == "rewrite"
+    assert len(edit.calls) == 1
+    assert tags(path) == [b"t" * 100]
+    assert top_level(path)[:3] == ["ftyp", "moov", "free"]
+    assert read_samples(path) == expected_samples()
+
+
+def test_hardlinked_file_is_not_modified_through_other_links(tmp_path):
+    path = fixed_file(tmp_path, 4096)
+    os.link(path, tmp_path / "dup.mp4")
+    original = (tmp_path / "dup.mp4").read_bytes()
+    assert update_moov(str(path), add_tag(100)) == "rewrite"
+    assert tags(path) == [b"t" * 100]
+    assert (tmp_path / "dup.mp4").read_bytes() == original
+    assert os.stat(path).st_nlink == 1
+
+
+def test_dedup_index_size_is_updated(tmp_path):
+    path = fixed_file(tmp_path, 0)
+    index_path = str(tmp_path / "index.jsonl")
+    fingerprint = content_fingerprint(str(tmp_path / "a.mp4"))
+    DedupIndex(index_path).record(fingerprint, str(path))
+    update_moov(str(path), add_tag(100), dedup_index=index_path)
+    assert DedupIndex(index_path).lookup(fingerprint) == str(path)